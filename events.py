@@ -0,0 +1,92 @@
+# This script answers questions about past repository activity from the local event history,
+# e.g. "what did fork X push this week?", without calling the GitHub API.
+#
+# Usage:
+# - python events.py config.yaml query --since 7d --repo owner/name
+# - python events.py config.yaml summary --since 30d
+# - python events.py config.yaml compact
+# With several families in the config, every family's history is read unless --family selects one.
+
+from observing.utils.events import query_events, summarize_events, compact_events, DEFAULT_RETENTION_DAYS, DEFAULT_MAX_ROWS
+from observing.utils.config import load_families
+from datetime import datetime
+import argparse
+import os
+import re
+import time
+import yaml
+
+UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+def parse_time(value):
+    """Parses a relative age such as '12h' or '7d', or an ISO date/datetime, into a UNIX timestamp."""
+    if value is None:
+        return None
+    match = re.fullmatch(r"(\d+)([mhdw])", value)
+    if match:
+        return time.time() - int(match.group(1)) * UNITS[match.group(2)]
+    return datetime.fromisoformat(value).timestamp()
+
+def short_sha(sha):
+    return sha[:7] if sha else "-"
+
+def family_db_dirs(config, family_name=None):
+    """Returns the database directories holding the event history of the selected (or every) family."""
+    families = load_families(config)
+    if family_name is not None:
+        families = [family for family in families if family["NAME"] == family_name]
+        if not families:
+            raise SystemExit(f"No family named {family_name} in the config")
+    # A family that never ran has no history yet
+    return [family["DATABASE_DIR"] for family in families if os.path.isdir(family["DATABASE_DIR"])]
+
+def print_events(events):
+    for event in reversed(events):
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event["occurred_at"]))
+        shas = f"{short_sha(event['before_sha'])}..{short_sha(event['after_sha'])}"
+        detail = " ".join(f"{key}={value}" for key, value in event["detail"].items() if value is not None)
+        print(f"{when}  {event['kind']:<17} {event['repo']:<40} {event['ref'] or '-':<30} {shas}  {detail}")
+
+if __name__ == "__main__":
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Query the history of detected repository changes.")
+    parser.add_argument("config_file", help="Path to the YAML configuration file.")
+    parser.add_argument("--family", help="Only the history of this family (NAME in the config); all families by default.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("query", "summary"):
+        subparser = subparsers.add_parser(name)
+        subparser.add_argument("--since", help="Start of the time window, e.g. 7d, 12h or 2024-09-01.")
+        subparser.add_argument("--until", help="End of the time window, same format as --since.")
+        subparser.add_argument("--repo", help="Only events of this repository (owner/name).")
+        subparser.add_argument("--ref", help="Only events of this branch or pull request (pull/<number>).")
+        subparser.add_argument("--kind", help="Only events of this kind, e.g. branch_updated or pr_merged.")
+        if name == "query":
+            subparser.add_argument("--limit", type=int, default=1000, help="Maximum number of events to show.")
+
+    subparsers.add_parser("compact", help="Apply the retention policy now.")
+    args = parser.parse_args()
+
+    # Load configuration from the specified YAML file
+    with open(args.config_file, "r") as f:
+        config = yaml.safe_load(f)
+    db_dirs = family_db_dirs(config, args.family)
+
+    if args.command == "query":
+        events = []
+        for db_dir in db_dirs:
+            events += query_events(db_dir, parse_time(args.since), parse_time(args.until), args.repo, args.ref, args.kind, args.limit)
+        # Newest first across families, like a single history
+        events.sort(key=lambda event: event["occurred_at"], reverse=True)
+        print_events(events[:args.limit])
+    elif args.command == "summary":
+        counts = {}
+        for db_dir in db_dirs:
+            for repo, kind, count in summarize_events(db_dir, parse_time(args.since), parse_time(args.until), args.repo, args.ref, args.kind):
+                counts[(repo, kind)] = counts.get((repo, kind), 0) + count
+        for (repo, kind), count in sorted(counts.items()):
+            print(f"{repo:<40} {kind:<17} {count}")
+    else:
+        deleted = sum(compact_events(db_dir, config.get("EVENTS_RETENTION_DAYS", DEFAULT_RETENTION_DAYS), config.get("EVENTS_MAX_ROWS", DEFAULT_MAX_ROWS))
+                      for db_dir in db_dirs)
+        print(f"Removed {deleted} events")
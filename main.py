@@ -1,5 +1,6 @@
 # This script initializes the main repository and repository family in the database,
 # and continuously runs a specified script at defined intervals.
+# Sending SIGUSR1 to this process profiles the next run (see observing/utils/profiling.py).
 #
 # Functions:
 # - run_bot: Runs a specified Python script in a loop with a delay between executions.
@@ -7,6 +8,9 @@
 import subprocess
 import time
 from observing.utils.database import init_main_repo, init_repo_fam
+from observing.utils.config import load_families
+from observing.utils.tokens import create_github_client
+from observing.utils.profiling import install_signal_handler, flag_next_cycle
 import os
 import argparse
 import yaml
@@ -44,16 +48,20 @@ if __name__ == "__main__":
     start_time = time.time()
     print(f"Initializing started: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}")
 
-    git_access_token = os.getenv('GIT_ACCESS_TOKEN')
-    db_dir = config.get("DATABASE_DIR")
-    main_repo_name = config.get("MAIN_REPO")
-    forks = config.get("FORKS", [])
+    github_client = create_github_client(config)
+    create_db_directory(config.get("DATABASE_DIR"))  # Create a db directory at the specified path
 
-    create_db_directory(db_dir)  # Create a db directory at the specified path
+    for family in load_families(config):
+        db_dir = family["DATABASE_DIR"]
+        create_db_directory(db_dir)
 
-    # Initialize the database with the specified path
-    init_main_repo(db_dir, git_access_token, main_repo_name)
-    init_repo_fam(db_dir, git_access_token, main_repo_name, forks)
+        # Initialize the family's database with the specified path
+        init_main_repo(db_dir, github_client, family["MAIN_REPO"])
+        init_repo_fam(db_dir, github_client, family["MAIN_REPO"], family["FORKS"])
+
+    # run.py picks up the flag file when its next cycle starts
+    install_signal_handler(lambda: flag_next_cycle(config.get("DATABASE_DIR")))
+    print(f"Send SIGUSR1 to process {os.getpid()} to profile the next run")
 
     timestamp = args.interval
     run_bot(timestamp, args.config_file)
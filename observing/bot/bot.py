@@ -3,12 +3,56 @@
 # It defines a function to format the embed data and make a POST request.
 import requests
 import json
+import time
 
-def post_to_discord(embed, webhook_url):
-    if embed == None:
+# Discord accepts up to 10 embeds per webhook message, with at most 6000 characters in total.
+DISCORD_MAX_EMBEDS = 10
+DISCORD_MAX_EMBED_CHARS = 6000
+# A hung webhook must not hold up the cycle (and the family's pipeline) forever.
+DISCORD_TIMEOUT = 30
+# Webhooks are rate limited to a few messages per second; a 429 is retried after the wait Discord asks for.
+DISCORD_MAX_RETRIES = 5
+
+def post_embeds_to_discord(embeds, webhook_url):
+    embeds = [embed for embed in embeds if embed is not None]
+    if not embeds:
         return
     data = {
-        "embeds": [embed]
+        "embeds": embeds
     }
-    response = requests.post(webhook_url, data=json.dumps(data), headers={"Content-Type": "application/json"})
-    return response.status_code, response.text
\ No newline at end of file
+    for attempt in range(DISCORD_MAX_RETRIES + 1):
+        response = requests.post(webhook_url, data=json.dumps(data), headers={"Content-Type": "application/json"}, timeout=DISCORD_TIMEOUT)
+        if response.status_code != 429 or attempt == DISCORD_MAX_RETRIES:
+            break
+        time.sleep(retry_after(response))
+    return response.status_code, response.text
+
+# Returns the seconds Discord asks to wait before retrying a rate limited request.
+def retry_after(response):
+    try:
+        return float(response.json()["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return float(response.headers.get("Retry-After", 1))
+
+# Approximates the number of characters Discord counts towards the embed limit.
+def embed_size(embed):
+    size = len(embed.get("title", "")) + len(embed.get("description", ""))
+    for field in embed.get("fields", []):
+        size += len(field.get("name", "")) + len(field.get("value", ""))
+    return size
+
+# Splits embeds into as few webhook messages as Discord's limits allow, keeping their order.
+def pack_embeds(embeds):
+    batches = []
+    batch = []
+    for embed in embeds:
+        if embed is None:
+            continue
+        if batch and (len(batch) == DISCORD_MAX_EMBEDS or
+                      sum(embed_size(e) for e in batch) + embed_size(embed) > DISCORD_MAX_EMBED_CHARS):
+            batches.append(batch)
+            batch = []
+        batch.append(embed)
+    if batch:
+        batches.append(batch)
+    return batches
@@ -3,12 +3,10 @@
 # It compares the current state of branches with a previously stored state, identifies new, updated, deleted, and rebased branches,
 # and checks for commits merged into the main branch without an associated pull request.
 
-import os
-from github import Github
-import requests
 import sqlite3
 import re
-import ast
+from observing.utils.compare_cache import CompareCache
+from observing.observer.report import FieldBuilder, branch_fragment_key, render_branch, render_fragment
 # Wraps URLs in angle brackets to prevent Discord from auto-linking them.
 def wrap_urls_with_angle_brackets(text):
     url_pattern = r'(https?://\S+)'
@@ -70,43 +68,63 @@ def load_previous_state(db_path):
 def convert_commits(paginated_commits):
     return [{"name": commit.commit.message.split('\n')[0], "link": commit.html_url, "sha": commit.sha} for commit in paginated_commits]
 
+# Returns the commit fields of a branch entry: the (bounded) commit list, the total and a link to the full compare.
+def comparison_commits(repo_full_name, comparison):
+    return {
+        "commits": comparison["commits"],
+        "total_commits": comparison.get("total_commits", len(comparison["commits"])),
+        "omitted_commits": comparison.get("omitted_commits", 0),
+        "compare_url": f"https://github.com/{repo_full_name}/compare/{comparison['base_sha']}...{comparison['head_sha']}",
+    }
+
 # Compares the current and previous states of branches to identify changes.
-def compare_states(current_state, previous_state, github_client):
+# Compares go through compare_cache, so identical (base SHA, head SHA) pairs are only fetched once.
+def compare_states(current_state, previous_state, github_client, compare_cache=None):
     new_branches = []
     updated_branches = []
     deleted_branches = []
     rebased_branches = []
+    if compare_cache is None:
+        compare_cache = CompareCache()
     current_branch_keys = {(b['repo_owner'], b['repo_name'], b['branch_name']) for b in current_state}
-    
+    previous_branches = {(b['repo_owner'], b['repo_name'], b['branch_name']): b for b in previous_state}
+    branch_shas = {(b['repo_owner'], b['repo_name'], b['branch_name']): b['commit_hash'] for b in current_state}
+
+    # Repositories are fetched lazily, only when a compare is not cached.
+    repos = {}
+    def get_repo(repo_full_name):
+        if repo_full_name not in repos:
+            repos[repo_full_name] = github_client.get_repo(repo_full_name)
+        return repos[repo_full_name]
+
     for current_branch in current_state:
         repo_full_name = f"{current_branch['repo_owner']}/{current_branch['repo_name']}"
-        repo = github_client.get_repo(repo_full_name)
-        
-        previous_branch = next((b for b in previous_state 
-                                if b["repo_owner"] == current_branch["repo_owner"] 
-                                and b["repo_name"] == current_branch["repo_name"] 
-                                and b["branch_name"] == current_branch["branch_name"]), None)
+        previous_branch = previous_branches.get((current_branch["repo_owner"], current_branch["repo_name"], current_branch["branch_name"]))
         
         if previous_branch is None:
+            repo = get_repo(repo_full_name)
             default_branch = repo.default_branch
-            comparison = repo.compare(default_branch, current_branch["branch_name"])
-            if comparison.commits:
+            base = branch_shas.get((current_branch["repo_owner"], current_branch["repo_name"], default_branch), default_branch)
+            comparison = compare_cache.compare(repo, base, current_branch["commit_hash"])
+            if comparison["commits"]:
                 new_branches.append({
                     "repo_owner": current_branch["repo_owner"],
                     "repo_name": current_branch["repo_name"],
                     "branch_name": current_branch["branch_name"],
                     "commit_hash": current_branch["commit_hash"],
-                    "commits": convert_commits(comparison.commits)
+                    **comparison_commits(repo_full_name, comparison)
                 })
         elif current_branch["commit_hash"] != previous_branch["commit_hash"]:
-            comparison = repo.compare(previous_branch["commit_hash"], current_branch["commit_hash"])
-            if comparison.commits:
+            comparison = compare_cache.compare(lambda: get_repo(repo_full_name), previous_branch["commit_hash"], current_branch["commit_hash"])
+            if comparison["commits"]:
                 if is_rebased(comparison):
                     rebased_branches.append({
                         "repo_owner": current_branch["repo_owner"],
                         "repo_name": current_branch["repo_name"],
                         "branch_name": current_branch["branch_name"],
-                        "commits": convert_commits(comparison.commits)
+                        "current_commit_hash": current_branch["commit_hash"],
+                        "previous_commit_hash": previous_branch["commit_hash"],
+                        **comparison_commits(repo_full_name, comparison)
                     })
                 else:
                     updated_branches.append({
@@ -115,7 +133,7 @@ def compare_states(current_state, previous_state, github_client):
                         "branch_name": current_branch["branch_name"],
                         "current_commit_hash": current_branch["commit_hash"],
                         "previous_commit_hash": previous_branch["commit_hash"],
-                        "commits": convert_commits(comparison.commits)
+                        **comparison_commits(repo_full_name, comparison)
                     })
     
     for previous_branch in previous_state:
@@ -124,10 +142,10 @@ def compare_states(current_state, previous_state, github_client):
     
     return new_branches, updated_branches, deleted_branches, rebased_branches
 
-# Determines if a branch has been rebased by checking the base commit SHA.
+# Determines if a branch has been rebased by checking the base commit SHA of a (cached) comparison.
 def is_rebased(comparison):
-    base_commit_sha = comparison.base_commit.sha
-    comparison_commit_shas = {commit.sha for commit in comparison.commits}
+    base_commit_sha = comparison["base_commit_sha"]
+    comparison_commit_shas = {commit["sha"] for commit in comparison["commits"]}
     
     return base_commit_sha not in comparison_commit_shas
 
@@ -165,6 +183,7 @@ def find_merged_commits_without_pr(main_repo_name, current_state, previous_state
         if (commit_sha and 
             commit_sha not in pr_commit_shas and 
             commit_sha not in pr_merge_commits):
+            commit["branch_name"] = main_branch_name
             merged_without_pr.append(commit)
 
     return merged_without_pr
@@ -183,78 +202,27 @@ def fetch_commits(repo_full_name, branch_name, since_commit, github_client):
         })
     return commits
 
-# Retrieves the GitHub profile image URL for a given repository owner.
-def get_github_profile_image(repo_owner):
-    url = f"https://api.github.com/users/{repo_owner}"
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        user_data = response.json()
-        return user_data.get("avatar_url")
-    return None
-
 # Generates a report of branch changes and movements.
-def generate_report(new_branches, updated_branches, deleted_branches, rebased_branches):
+# Branch entries are rendered through fragment_cache when given, so an entry rendered before is reused.
+def generate_report(new_branches, updated_branches, deleted_branches, rebased_branches, fragment_cache=None):
     fields = []
 
-    if new_branches:
-        new_field = {
-            "name": "\n\n🌿 **New branches and commits** 🌿\n\n\n",
-            "value": "",
-            "inline": False
-        }
-        for branch in new_branches:
-            if not branch["commits"]:
-                continue
-            avatar = get_github_profile_image(branch["repo_owner"])
-            repo_full_name = f"{branch['repo_owner']}/{branch['repo_name']}"
-            branch_url = f"https://github.com/{repo_full_name}/tree/{branch['branch_name']}"
-            new_field["value"] += f"\n* *branch* : [{branch['branch_name']} [{repo_full_name}]]({branch_url})\n"
-            for i, commit in enumerate(branch["commits"]):
-                new_field["value"] += f"\n * [{commit['name']}]({commit['link']})" if i else f" * [{commit['name']}]({commit['link']})"
-        fields.append(new_field)
-
-    if updated_branches:
-        updated_field = {
-            "name": "\n\n🌿 **Updated branches and commits** 🌿\n",
-            "value": "",
-            "inline": False
-        }
-        for branch in updated_branches:
-            repo_full_name = f"{branch['repo_owner']}/{branch['repo_name']}"
-            branch_url = f"https://github.com/{repo_full_name}/tree/{branch['branch_name']}"
-            updated_field["value"] += f"\n* *branch* : [{branch['branch_name']} [{repo_full_name}]]({branch_url})\n"
-            for i, commit in enumerate(branch["commits"]):
-                updated_field["value"] += f"\n * [{commit['name']}]({commit['link']})" if i else f" * [{commit['name']}]({commit['link']})"
-        fields.append(updated_field)
-
-    if deleted_branches:
-        deleted_field = {
-            "name": "\n\n🌿 **Deleted branches** 🌿\n",
-            "value": "",
-            "inline": False
-        }
-        for branch in deleted_branches:
-            repo_full_name = f"{branch['repo_owner']}/{branch['repo_name']}"
-            branch_url = f"https://github.com/{repo_full_name}/tree/{branch['branch_name']}"
-            deleted_field["value"] += f"\n* *branch* : [{branch['branch_name']} [{repo_full_name}]]({branch_url})\n"
-        fields.append(deleted_field)
-
-    if rebased_branches:
-        rebased_field = {
-            "name": "\n\n🌿 **Rebased branches and commits** 🌿\n",
-            "value": "",
-            "inline": False
-        }
-        for branch in rebased_branches:
-            if not branch["commits"]:
+    sections = [
+        ("\n\n🌿 **New branches and commits** 🌿\n\n\n", new_branches),
+        ("\n\n🌿 **Updated branches and commits** 🌿\n", updated_branches),
+        ("\n\n🌿 **Deleted branches** 🌿\n", deleted_branches),
+        ("\n\n🌿 **Rebased branches and commits** 🌿\n", rebased_branches),
+    ]
+    for name, branches in sections:
+        if not branches:
+            continue
+        field = FieldBuilder(name)
+        for branch in branches:
+            # Deleted branches have no commit list; the others are only listed with commits
+            if "commits" in branch and not branch["commits"]:
                 continue
-            repo_full_name = f"{branch['repo_owner']}/{branch['repo_name']}"
-            branch_url = f"https://github.com/{repo_full_name}/tree/{branch['branch_name']}"
-            rebased_field["value"] += f"\n* *branch* : [{branch['branch_name']} [{repo_full_name}]]({branch_url})\n"
-            for i, commit in enumerate(branch["commits"]):
-                rebased_field["value"] += f"\n * [{commit['name']}]({commit['link']})" if i else f" * [{commit['name']}]({commit['link']})"
-        fields.append(rebased_field)
+            field.append(render_fragment(fragment_cache, branch_fragment_key(branch), render_branch, branch))
+        fields.append(field.build())
     embed = {
         "title": "🌟 BRANCH REPORT 🌟",
         "color": 642600,  # Hex color code in decimal
@@ -267,22 +235,18 @@ def generate_report(new_branches, updated_branches, deleted_branches, rebased_br
 
 # Generates a report for commits merged into the main branch without a pull request.
 def generate_merged_commits_without_pr_report(merged_commits_without_pr):
-    field = {
-        "name": "The following commits were merged into the main branch of the repo without an associated pull request\n\n",
-        "value": "",
-        "inline": False
-    }
+    field = FieldBuilder("The following commits were merged into the main branch of the repo without an associated pull request\n\n")
 
     if merged_commits_without_pr:
         for i, commit in enumerate(merged_commits_without_pr):
-            field["value"] += f"\n* [{commit['name']}]({commit['link']})" if i else f"* [{commit['name']}]({commit['link']})"
+            field.append(f"\n* [{commit['name']}]({commit['link']})" if i else f"* [{commit['name']}]({commit['link']})")
     else:
-        field["value"] += "No commits were merged without a pull request.\n"
+        field.append("No commits were merged without a pull request.\n")
 
     embed = {
         "title": "🔥 __ MERGED COMMITS WITHOUT PR __ 🔥",
         "color": 12910592,  # Hex color code in decimal
-        "fields": [field],
+        "fields": [field.build()],
         "thumbnail": {
             "url": "https://example.com/image.png"
         },
@@ -291,30 +255,3 @@ def generate_merged_commits_without_pr_report(merged_commits_without_pr):
         embed = None
 
     return embed
-
-# Main function to generate and post branch reports.
-def branch_movements(db_dir, git_access_token, main_repo_name, forks):
-
-    github_client = Github(git_access_token)
-    if isinstance(forks, str):
-        forks = ast.literal_eval(forks)
-    repo_family = [main_repo_name] + forks
-
-    db_path = os.path.join(db_dir, 'repo_fam.db')
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-
-    current_state = fetch_current_repo_state(repo_family, github_client)
-    previous_state = load_previous_state(db_path)
-    new_branches, updated_branches, deleted_branches, rebased_branches = compare_states(current_state, previous_state, github_client)
-    merged_without_pr = find_merged_commits_without_pr(main_repo_name, current_state, previous_state, github_client)
-
-    merged_commits_without_pr_sha = [commit["sha"] for commit in merged_without_pr]
-    rebased_branches_result = [
-        branch for branch in rebased_branches 
-        if any(commit["sha"] not in merged_commits_without_pr_sha 
-            for commit in branch["commits"])
-    ]
-    report = generate_report(new_branches, updated_branches, deleted_branches, rebased_branches_result)
-
-    merged_commits_without_pr_report = generate_merged_commits_without_pr_report(merged_without_pr)
-    return report, merged_commits_without_pr_report
\ No newline at end of file
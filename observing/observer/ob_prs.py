@@ -3,101 +3,71 @@
 #
 # Functions:
 # - add_indentation: Adds indentation to each line of a given text.
-# - fetch_pr_details: Retrieves details of a pull request, including its title, URL, author, and commits.
-# - format_report_prs: Formats a report for merged, unmerged, and open pull requests.
-# - find_open_merged_pr: Finds open, merged, and unmerged pull requests by comparing previous and current states.
+# - fetch_pr_details: Retrieves details of a pull request, including its title, URL, author, and its first and last commits
+#   unless its report fragment is already cached.
+# - format_report_prs: Formats a report for merged, unmerged, and open pull requests, reusing cached fragments.
+# - classify_prs: Sorts pull requests into merged, unmerged, open and reopened by comparing previous and current states.
+# - classify_and_format_prs: Finds open, merged, and unmerged pull requests and returns the report with its events,
+#   so callers can record the events only once the report was posted.
+# - find_open_merged_pr: Finds open, merged, and unmerged pull requests, records them as events and formats the report.
+
+from observing.utils.events import record_events, pr_events
+from observing.observer.report import FieldBuilder, pr_fragment_key, render_pr
+from observing.utils.commits import pull_request_commits, DEFAULT_COMMIT_LIMIT
+from observing.utils.profiling import stage
 
 
 def add_indentation(text, spaces=4):
     indentation = ' ' * spaces
     return '\n'.join([indentation + line for line in text.split('\n')])
 
-def fetch_pr_details(repo, pr_number):
+def fetch_pr_details(repo, pr_number, commit_limit=DEFAULT_COMMIT_LIMIT, fragment_cache=None):
     pr = repo.get_pull(pr_number)
-    commits = pr.get_commits()
-    commit_details = [{'name': commit.commit.message.split('\n')[0], 'link': commit.html_url} for commit in commits]
-
-    return {
+    pr_details = {
         'title': pr.title,
         'url': pr.html_url,
         'author': pr.user.login,
-        'commits': commit_details
+        'head_sha': pr.head.sha,
+        'merge_commit_sha': pr.merge_commit_sha if pr.merged else None,
+        'total_commits': pr.commits,
+        'commits_url': f"{pr.html_url}/commits"
     }
 
-def format_report_prs(merged_prs, unmerged_prs, open_prs, reopened_prs, repo):
+    # A pull request rendered before in the same state doesn't need its commits again
+    if fragment_cache is not None:
+        pr_details['fragment'] = fragment_cache.get(pr_fragment_key(pr_details, commit_limit))
+        if pr_details['fragment'] is not None:
+            return pr_details
+
+    # Only the first and last commit_limit commits are fetched, however large the pull request is
+    pr_details['commits'], pr_details['omitted_commits'] = pull_request_commits(repo, pr, commit_limit)
+    return pr_details
+
+# Fetched details are also stored in pr_details_by_number when given, so callers can reuse them.
+def format_report_prs(merged_prs, unmerged_prs, open_prs, reopened_prs, repo, pr_details_by_number=None, commit_limit=DEFAULT_COMMIT_LIMIT, fragment_cache=None):
     fields = []
+    if pr_details_by_number is None:
+        pr_details_by_number = {}
 
-    if open_prs:
-        open_field = {
-            "name": "\n\n🌟 **Opened Pull Requests** 🌟\n\n",
-            "value": "",
-            "inline": False
-        }
-        for pr_number in open_prs:
-            pr_details = fetch_pr_details(repo, pr_number)
-            if pr_details:
-                open_field["value"] += f"\n- [{pr_details['title']}]({pr_details['url']}) by [{pr_details['author']}](https://github.com/{pr_details['author']})\n"
-                open_field["value"] += "\tCommits:\n"
-                for i, commit in enumerate(pr_details["commits"]):
-                    if i:
-                        open_field["value"] += f"\n\t* [{commit['name']}]({commit['link']})"
-                    else: 
-                        open_field["value"] += f"\t* [{commit['name']}]({commit['link']})"
-        fields.append(open_field)
-
-    if reopened_prs:
-        reopened_field = {
-            "name": "\n\n🚪 **Reopened Pull Requests** 🚪\n\n",
-            "value": "",
-            "inline": False
-        }
-        for pr_number in reopened_prs:
-            pr_details = fetch_pr_details(repo, pr_number)
-            if pr_details:
-                reopened_field["value"] += f"\n- [{pr_details['title']}]({pr_details['url']}) by [{pr_details['author']}](https://github.com/{pr_details['author']})\n"
-                reopened_field["value"] += "\tCommits:\n"
-                for i, commit in enumerate(pr_details["commits"]):
-                    if i:
-                        reopened_field["value"] += f"\n\t* [{commit['name']}]({commit['link']})"
-                    else: 
-                        reopened_field["value"] += f"\t* [{commit['name']}]({commit['link']})"
-        fields.append(reopened_field)
-
-    if merged_prs:
-        merged_field = {
-            "name": "\n\n🎉 **Merged Pull Requests** 🎉\n\n",
-            "value": "",
-            "inline": False
-        }
-        for pr_number in merged_prs:
-            pr_details = fetch_pr_details(repo, pr_number)
-            if pr_details:
-                merged_field["value"] += f"\n- [{pr_details['title']}]({pr_details['url']}) by [{pr_details['author']}](https://github.com/{pr_details['author']})\n"
-                merged_field["value"] += "\tCommits:\n"
-                for i, commit in enumerate(pr_details["commits"]):
-                    if i:
-                        merged_field["value"] += f"\n\t* [{commit['name']}]({commit['link']})"
-                    else: 
-                        merged_field["value"] += f"\t* [{commit['name']}]({commit['link']})"
-        fields.append(merged_field)
-
-    if unmerged_prs:
-        unmerged_field = {
-            "name": "\n\n🛑 **Closed without merging** 🛑\n\n",
-            "value": "",
-            "inline": False
-        }
-        for pr_number in unmerged_prs:
-            pr_details = fetch_pr_details(repo, pr_number)
-            if pr_details:
-                unmerged_field["value"] += f"\n- [{pr_details['title']}]({pr_details['url']}) by [{pr_details['author']}](https://github.com/{pr_details['author']})\n"
-                unmerged_field["value"] += "\tCommits:\n"
-                for i, commit in enumerate(pr_details["commits"]):
-                    if i:
-                        unmerged_field["value"] += f"\n\t* [{commit['name']}]({commit['link']})"
-                    else: 
-                        unmerged_field["value"] += f"\t* [{commit['name']}]({commit['link']})"
-        fields.append(unmerged_field)
+    sections = [
+        ("\n\n🌟 **Opened Pull Requests** 🌟\n\n", open_prs),
+        ("\n\n🚪 **Reopened Pull Requests** 🚪\n\n", reopened_prs),
+        ("\n\n🎉 **Merged Pull Requests** 🎉\n\n", merged_prs),
+        ("\n\n🛑 **Closed without merging** 🛑\n\n", unmerged_prs),
+    ]
+    for name, pr_numbers in sections:
+        if not pr_numbers:
+            continue
+        field = FieldBuilder(name)
+        for pr_number in pr_numbers:
+            pr_details = fetch_pr_details(repo, pr_number, commit_limit, fragment_cache)
+            pr_details_by_number[pr_number] = pr_details
+            if pr_details.get('fragment') is None:
+                pr_details['fragment'] = render_pr(pr_details)
+                if fragment_cache is not None:
+                    fragment_cache.put(pr_fragment_key(pr_details, commit_limit), pr_details['fragment'])
+            field.append(pr_details['fragment'])
+        fields.append(field.build())
 
     embed = {
         "title": "🚀 PULL REQUEST REPORT 🚀",
@@ -108,7 +78,7 @@ def format_report_prs(merged_prs, unmerged_prs, open_prs, reopened_prs, repo):
         embed = None
     return embed
 
-def find_open_merged_pr(previous_state, current_state, main_repo):
+def classify_prs(previous_state, current_state, main_repo):
     merged_prs = []
     unmerged_prs = []
     open_prs = []
@@ -145,5 +115,22 @@ def find_open_merged_pr(previous_state, current_state, main_repo):
             else:
                 unmerged_prs.append(pr_number)
 
-    report_prs = format_report_prs(merged_prs, unmerged_prs, open_prs, reopened_prs, main_repo)
-    return report_prs
\ No newline at end of file
+    return merged_prs, unmerged_prs, open_prs, reopened_prs
+
+def classify_and_format_prs(previous_state, current_state, main_repo, commit_limit=DEFAULT_COMMIT_LIMIT, fragment_cache=None):
+    with stage("pr_diff"):
+        merged_prs, unmerged_prs, open_prs, reopened_prs = classify_prs(previous_state, current_state, main_repo)
+
+    pr_details_by_number = {}
+    with stage("render"):
+        report_prs = format_report_prs(merged_prs, unmerged_prs, open_prs, reopened_prs, main_repo, pr_details_by_number, commit_limit, fragment_cache)
+    return report_prs, pr_events(main_repo.full_name, merged_prs, unmerged_prs, open_prs, reopened_prs, pr_details_by_number)
+
+def find_open_merged_pr(previous_state, current_state, main_repo, db_dir=None, commit_limit=DEFAULT_COMMIT_LIMIT, fragment_cache=None):
+    report_prs, events = classify_and_format_prs(previous_state, current_state, main_repo, commit_limit, fragment_cache)
+
+    # Append the detected changes to the event history
+    if db_dir:
+        with stage("db_writes"):
+            record_events(db_dir, events)
+    return report_prs
@@ -0,0 +1,265 @@
+# This script runs one observer cycle as a staged pipeline, so GitHub and Discord latency overlap.
+# Fetchers diff each repository of the family on a pool of threads and emit per-repository deltas,
+# a formatter turns the deltas into report embeds and records them as events, and a sender posts
+# finished embeds while other repositories are still being fetched. The queues between the stages
+# are bounded, so a slow stage holds back the ones before it instead of buffering whole reports.
+# A sequential run (used for profiled cycles) runs the stages one after another in the calling thread.
+#
+# Functions:
+# - fetch_main_repo_state: Fetches the main repository with its current pull request and branch state.
+# - fetch_repo_delta: Fetches one repository's branches and compares them with the previous state.
+# - group_by_repo: Groups a branch state list by repository full name.
+# - repo_data_from_branches: Converts one repository's branch state into the format stored by database.py.
+# - run_pipeline: Runs the pull request and branch reports of one cycle and writes the new state.
+
+import itertools
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from observing.bot.bot import post_embeds_to_discord, pack_embeds
+from observing.observer.ob_branch import (fetch_current_repo_state, load_previous_state, compare_states,
+                                          find_merged_commits_without_pr, generate_report,
+                                          generate_merged_commits_without_pr_report)
+from observing.observer.ob_prs import classify_and_format_prs
+from observing.utils.commits import DEFAULT_COMMIT_LIMIT
+from observing.utils.compare_cache import CompareCache
+from observing.utils.fragment_cache import FragmentCache
+from observing.utils.profiling import stage
+from observing.utils.database import update_main_repo, initialize_database_with_branches
+from observing.utils.events import record_events, branch_events
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 8
+
+_DONE = object()
+
+
+def fetch_main_repo_state(github_client, main_repo_name):
+    """Fetches the main repository together with its current pull request and branch state."""
+    main_repo = github_client.get_repo(main_repo_name)
+
+    # Gather pull requests and branches from the main repository
+    main_prs = {pr.number: pr.state for pr in main_repo.get_pulls(state="all")}
+    main_branches = [branch.name for branch in main_repo.get_branches()]
+
+    # Prepare current state dictionary
+    current_state = {
+        "branches": main_branches,
+        "prs": {int(key): value for key, value in main_prs.items()}
+    }
+    return main_repo, current_state
+
+def fetch_repo_delta(repo_full_name, previous_state, github_client, compare_cache, main_repo_name=None, merged_without_pr_shas=()):
+    """
+    Fetches the branches of one repository and compares them with its previous state.
+    For the main repository (main_repo_name given) commits merged without a pull request are detected as well.
+    """
+    current_state = fetch_current_repo_state([repo_full_name], github_client)
+    with stage("compare_states"):
+        new_branches, updated_branches, deleted_branches, rebased_branches = compare_states(current_state, previous_state, github_client, compare_cache)
+
+    merged_without_pr = []
+    if main_repo_name:
+        with stage("find_merged_commits_without_pr"):
+            merged_without_pr = find_merged_commits_without_pr(main_repo_name, current_state, previous_state, github_client)
+        merged_without_pr_shas = {commit["sha"] for commit in merged_without_pr}
+
+    return {
+        "repo": repo_full_name,
+        "current_state": current_state,
+        "new_branches": new_branches,
+        "updated_branches": updated_branches,
+        "deleted_branches": deleted_branches,
+        "rebased_branches": rebased_branches,
+        # Rebases that only consist of commits merged without a PR are reported once, as such commits.
+        "reported_rebased_branches": [
+            branch for branch in rebased_branches
+            if any(commit["sha"] not in merged_without_pr_shas for commit in branch["commits"])
+        ],
+        "merged_without_pr": merged_without_pr,
+    }
+
+def group_by_repo(state):
+    grouped = {}
+    for branch in state:
+        grouped.setdefault(f"{branch['repo_owner']}/{branch['repo_name']}", []).append(branch)
+    return grouped
+
+def repo_data_from_branches(repo_full_name, branches):
+    owner, name = repo_full_name.split('/')
+    return {"owner": owner, "name": name, "branches": {b["branch_name"]: b["commit_hash"] for b in branches}}
+
+def _sender(send_queue, webhook_url, db_dir, main_repo_name, unreported):
+    # Every report (the embeds of one delta) is posted on its own, packed into as few messages as
+    # Discord allows. The messages then only depend on the report, not on how fast the fetchers were,
+    # so a replayed cycle sends the same webhook bodies as the recorded one. The changes of a report
+    # are only recorded as events once Discord accepted all of its messages; otherwise its repository
+    # (None for the pull request report) goes to unreported and keeps its previous state.
+    while True:
+        item = send_queue.get()
+        if item is _DONE:
+            return
+        delta, embeds = item
+        if all(_post(batch, webhook_url) for batch in pack_embeds(embeds)):
+            with stage("db_writes"):
+                record_events(db_dir, _delta_events(delta, main_repo_name))
+        else:
+            unreported.append(delta.get("repo"))
+
+def _post(embeds, webhook_url):
+    try:
+        status_code, text = post_embeds_to_discord(embeds, webhook_url)
+    except Exception as e:
+        print(f"Failed to post {len(embeds)} embeds to Discord: {e}")
+        return False
+    if not 200 <= status_code < 300:
+        print(f"Discord rejected {len(embeds)} embeds with status {status_code}: {text[:200]}")
+        return False
+    return True
+
+def _formatter(delta_queue, send_queue, main_repo_name, fragment_cache, unreported):
+    while True:
+        delta = delta_queue.get()
+        if delta is _DONE:
+            send_queue.put(_DONE)
+            return
+        # Keep draining the queue on errors, otherwise the fetchers would block forever.
+        try:
+            send_queue.put((delta, _format_delta(delta, main_repo_name, fragment_cache)))
+        except Exception as e:
+            print(f"Failed to format report for {delta.get('repo', 'pull requests')}: {e}")
+            unreported.append(delta.get("repo"))
+
+def _delta_events(delta, main_repo_name):
+    if "embed" in delta:
+        return delta["events"]
+    return branch_events(main_repo_name, delta["new_branches"], delta["updated_branches"],
+                         delta["deleted_branches"], delta["rebased_branches"], delta["merged_without_pr"])
+
+def _format_delta(delta, main_repo_name, fragment_cache=None):
+    if "embed" in delta:
+        return [delta["embed"]] if delta["embed"] is not None else []
+
+    with stage("render"):
+        report = generate_report(delta["new_branches"], delta["updated_branches"], delta["deleted_branches"], delta["reported_rebased_branches"], fragment_cache)
+        merged_commits_without_pr_report = generate_merged_commits_without_pr_report(delta["merged_without_pr"])
+    return [embed for embed in (report, merged_commits_without_pr_report) if embed is not None]
+
+def run_pipeline(db_dir, github_client, main_repo, forks, webhook_url, previous_main_state, current_main_state,
+                 workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, executor=None, compare_cache=None,
+                 commit_limit=DEFAULT_COMMIT_LIMIT, fragment_cache=None, sequential=False):
+    """
+    Runs the pull request and branch reports of one cycle and stores the new state.
+    A repository that fails to fetch, or whose report Discord doesn't accept, keeps its previous state,
+    so its changes are reported next cycle.
+
+    Fetches run on executor (anything with a concurrent.futures-style submit), compares go through
+    compare_cache and rendered report entries through fragment_cache; they are shared between families
+    when given, otherwise they are created for this cycle.
+
+    With sequential, the deltas are buffered and formatted and posted in the calling thread once all of
+    them are fetched; together with an executor that runs tasks inline the whole cycle runs in one thread.
+    """
+    main_repo_name = main_repo.full_name
+    previous_by_repo = group_by_repo(load_previous_state(os.path.join(db_dir, 'repo_fam.db')))
+    own_compare_cache = compare_cache is None
+    if own_compare_cache:
+        compare_cache = CompareCache(db_dir, commit_limit=commit_limit)
+    own_fragment_cache = fragment_cache is None
+    if own_fragment_cache:
+        fragment_cache = FragmentCache(db_dir)
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetcher")
+
+    unreported = []
+    if sequential:
+        delta_queue = queue.Queue()
+        send_queue = queue.Queue()
+    else:
+        delta_queue = queue.Queue(maxsize=queue_size)
+        send_queue = queue.Queue(maxsize=queue_size)
+        sender = threading.Thread(target=_sender, args=(send_queue, webhook_url, db_dir, main_repo_name, unreported), name=f"discord-sender-{main_repo_name}")
+        formatter = threading.Thread(target=_formatter, args=(delta_queue, send_queue, main_repo_name, fragment_cache, unreported), name=f"report-formatter-{main_repo_name}")
+        sender.start()
+        formatter.start()
+
+    repo_data = {}
+    failed = []
+
+    # Tasks only return their results; this (the family's own) thread hands them to the formatter,
+    # so shared fetch workers never block on the queues of a family whose webhook is slow. At most
+    # queue_size forks are fetched ahead of the formatter, so a slow report still holds back the fetches.
+    def report_prs():
+        embed, events = classify_and_format_prs(previous_main_state, current_main_state, main_repo, commit_limit, fragment_cache)
+        return {"embed": embed, "events": events}
+
+    def report_branches(repo_full_name, **kwargs):
+        previous_state = previous_by_repo.get(repo_full_name, [])
+        try:
+            delta = fetch_repo_delta(repo_full_name, previous_state, github_client, compare_cache, **kwargs)
+        except Exception as e:
+            print(f"Failed to fetch {repo_full_name}: {e}")
+            failed.append(repo_full_name)
+            repo_data[repo_full_name] = repo_data_from_branches(repo_full_name, previous_state)
+            return None
+        repo_data[repo_full_name] = repo_data_from_branches(repo_full_name, delta["current_state"])
+        return delta
+
+    try:
+        prs_future = executor.submit(report_prs)
+        # The main repository goes first: its commits merged without a PR filter the rebases of the forks.
+        main_delta = executor.submit(report_branches, main_repo_name, main_repo_name=main_repo_name).result()
+        merged_without_pr_shas = {commit["sha"] for commit in main_delta["merged_without_pr"]} if main_delta else set()
+        if main_delta:
+            delta_queue.put(main_delta)
+        remaining_forks = iter([fork for fork in forks if fork != main_repo_name])
+        pending = {prs_future}
+        for fork in itertools.islice(remaining_forks, queue_size or None):
+            pending.add(executor.submit(report_branches, fork, merged_without_pr_shas=merged_without_pr_shas))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result() is not None:
+                    delta_queue.put(future.result())
+                elif future is not prs_future and future.exception() is not None:
+                    print(f"Failed to report a repository: {future.exception()}")
+                if future is not prs_future:
+                    # The delta now belongs to the formatter; the next fork takes the free slot.
+                    for fork in itertools.islice(remaining_forks, 1):
+                        pending.add(executor.submit(report_branches, fork, merged_without_pr_shas=merged_without_pr_shas))
+        prs_error = prs_future.exception()
+    finally:
+        delta_queue.put(_DONE)
+        if sequential:
+            _formatter(delta_queue, send_queue, main_repo_name, fragment_cache, unreported)
+            _sender(send_queue, webhook_url, db_dir, main_repo_name, unreported)
+        else:
+            formatter.join()
+            sender.join()
+        if own_executor:
+            executor.shutdown()
+        if own_compare_cache:
+            compare_cache.close()
+        if own_fragment_cache:
+            fragment_cache.close()
+        else:
+            fragment_cache.flush()
+
+    for repo_full_name in unreported:
+        if repo_full_name is None:
+            prs_error = prs_error or RuntimeError("the report was not posted")
+        else:
+            failed.append(repo_full_name)
+            repo_data[repo_full_name] = repo_data_from_branches(repo_full_name, previous_by_repo.get(repo_full_name, []))
+
+    # Update the database with the current state
+    with stage("db_writes"):
+        if prs_error is None:
+            update_main_repo(db_dir, current_main_state)
+        else:
+            print(f"Failed to report pull requests: {prs_error}")
+        initialize_database_with_branches(db_dir, repo_data)
+    return failed
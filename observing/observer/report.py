@@ -0,0 +1,67 @@
+# This script renders the pull request and branch entries of the Discord reports.
+# Each entry is rendered into a fragment once and joined into its embed field, instead of growing the
+# field value with repeated string concatenation. Fragments are keyed by the state and SHAs of the entry,
+# so with a FragmentCache an entry that was rendered before is reused as is.
+#
+# Functions:
+# - FieldBuilder: Collects the fragments of one embed field and joins them.
+# - pr_fragment_key / render_pr: Key and fragment of a pull request entry.
+# - branch_fragment_key / render_branch: Key and fragment of a branch entry.
+# - render_fragment: Returns the fragment of an entry, through the cache when one is given.
+
+from observing.utils.commits import omitted_commits_position, more_commits_line
+
+
+class FieldBuilder:
+    """Builds one embed field from fragments; the value is joined once, when the field is built."""
+
+    def __init__(self, name):
+        self.name = name
+        self.parts = []
+
+    def append(self, fragment):
+        self.parts.append(fragment)
+
+    def build(self):
+        return {"name": self.name, "value": "".join(self.parts), "inline": False}
+
+
+def _commit_lines(item, first_prefix, prefix, url, label):
+    # The first commit follows the entry header directly, the others start on a new line;
+    # the "+K more" line sits between the first and the last commits of a bounded list.
+    parts = []
+    position = omitted_commits_position(item)
+    for i, commit in enumerate(item.get("commits", ())):
+        if i and i == position:
+            parts.append(f"{prefix}{more_commits_line(item['omitted_commits'], item[url], label)}")
+        parts.append(f"{prefix if i else first_prefix}[{commit['name']}]({commit['link']})")
+    return parts
+
+def pr_fragment_key(pr_details, commit_limit):
+    return ("pr", pr_details['url'], pr_details['head_sha'], pr_details['merge_commit_sha'],
+            pr_details['total_commits'], commit_limit, pr_details['title'], pr_details['author'])
+
+def render_pr(pr_details):
+    parts = [
+        f"\n- [{pr_details['title']}]({pr_details['url']}) by [{pr_details['author']}](https://github.com/{pr_details['author']})\n",
+        "\tCommits:\n",
+    ]
+    parts += _commit_lines(pr_details, "\t* ", "\n\t* ", 'commits_url', 'all commits')
+    return "".join(parts)
+
+def branch_fragment_key(branch):
+    # The compare URL holds both SHAs the commit list was taken from; deleted branches only have their last SHA.
+    return ("branch", branch['repo_owner'], branch['repo_name'], branch['branch_name'],
+            branch.get('compare_url', branch.get('commit_hash')), len(branch.get('commits', ())), branch.get('omitted_commits', 0))
+
+def render_branch(branch):
+    repo_full_name = f"{branch['repo_owner']}/{branch['repo_name']}"
+    branch_url = f"https://github.com/{repo_full_name}/tree/{branch['branch_name']}"
+    parts = [f"\n* *branch* : [{branch['branch_name']} [{repo_full_name}]]({branch_url})\n"]
+    parts += _commit_lines(branch, " * ", "\n * ", 'compare_url', 'full compare')
+    return "".join(parts)
+
+def render_fragment(fragment_cache, key, render, item):
+    if fragment_cache is None:
+        return render(item)
+    return fragment_cache.render(key, render, item)
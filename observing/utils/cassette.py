@@ -0,0 +1,175 @@
+# This script records and replays HTTP traffic so an observer cycle can be reproduced offline.
+# Every request made through `requests` (PyGithub's transport as well as the webhook posts in bot.py)
+# goes through HTTPAdapter.send, which is patched while a cassette is active.
+# Exchanges are stored as gzip-compressed JSON lines; the request URL is kept verbatim, so treat
+# cassettes like the config file (Discord webhook URLs contain their token).
+#
+# Functions:
+# - recording: Context manager that captures every HTTP exchange into a cassette file.
+# - replaying: Context manager that serves HTTP exchanges from a cassette file without network access.
+
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+CASSETTE_VERSION = 1
+
+# Headers describing the wire encoding; the stored body is already decoded.
+_TRANSPORT_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+_original_send = HTTPAdapter.send
+_active = None
+_patch_lock = threading.Lock()
+
+
+# Raised when a replayed cycle issues a request that is not in the cassette.
+class CassetteMiss(requests.ConnectionError):
+    pass
+
+
+# Key used to match a replayed request against the recorded ones.
+def _request_key(request):
+    body = request.body
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    body_sha = hashlib.sha1(body).hexdigest() if body else None
+    return request.method, request.url, body_sha
+
+
+def _encode_body(content):
+    try:
+        return {"body": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"body_b64": base64.b64encode(content).decode("ascii")}
+
+
+def _decode_body(entry):
+    if "body_b64" in entry:
+        return base64.b64decode(entry["body_b64"])
+    return entry.get("body", "").encode("utf-8")
+
+
+class _Recorder:
+    def __init__(self, path):
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.file.write(json.dumps({"version": CASSETTE_VERSION, "recorded_at": time.time()}) + "\n")
+
+    def send(self, adapter, request, **kwargs):
+        sent_at = time.monotonic()
+        response = _original_send(adapter, request, **kwargs)
+        content = response.content or b""
+        method, url, body_sha = _request_key(request)
+        entry = {
+            "t": round(sent_at - self.started, 4),
+            "elapsed": round(time.monotonic() - sent_at, 4),
+            "method": method,
+            "url": url,
+            "body_sha": body_sha,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() not in _TRANSPORT_HEADERS},
+        }
+        entry.update(_encode_body(content))
+        with self.lock:
+            self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        return response
+
+    def close(self):
+        self.file.close()
+
+
+class _Player:
+    def __init__(self, path, realtime):
+        self.realtime = realtime
+        self.lock = threading.Lock()
+        self.started = None
+        self.exchanges = defaultdict(deque)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version: {header.get('version')}")
+            for line in f:
+                entry = json.loads(line)
+                self.exchanges[(entry["method"], entry["url"], entry["body_sha"])].append(entry)
+
+    def send(self, adapter, request, **kwargs):
+        key = _request_key(request)
+        with self.lock:
+            queue = self.exchanges.get(key)
+            if not queue:
+                raise CassetteMiss(f"No recorded response for {key[0]} {key[1]}", request=request)
+            # Keep the last exchange around so repeated polling of the same URL keeps working.
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+            if self.started is None:
+                self.started = time.monotonic() - entry["t"]
+
+        if self.realtime:
+            # Deliver the response at the offset it arrived at in the recorded cycle; a replay that
+            # has fallen behind the recording is not slowed down further.
+            delay = self.started + entry["t"] + entry["elapsed"] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry["reason"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = _decode_body(entry)
+        response.url = request.url
+        response.request = request
+        response.connection = adapter
+        response.elapsed = timedelta(seconds=entry["elapsed"])
+        return response
+
+    def close(self):
+        pass
+
+
+def _patched_send(adapter, request, **kwargs):
+    if _active is None:
+        return _original_send(adapter, request, **kwargs)
+    return _active.send(adapter, request, **kwargs)
+
+
+@contextmanager
+def _activate(cassette):
+    global _active
+    with _patch_lock:
+        if _active is not None:
+            cassette.close()
+            raise RuntimeError("A cassette is already active")
+        _active = cassette
+        HTTPAdapter.send = _patched_send
+    try:
+        yield cassette
+    finally:
+        with _patch_lock:
+            HTTPAdapter.send = _original_send
+            _active = None
+        cassette.close()
+
+
+# Captures every HTTP exchange made inside the block into the cassette at `path`.
+def recording(path):
+    return _activate(_Recorder(path))
+
+
+# Serves every HTTP exchange made inside the block from the cassette at `path`.
+# With realtime=True responses are paced like the recording: each one arrives at its recorded
+# offset (start time plus latency) from the first request of the cycle.
+def replaying(path, realtime=False):
+    return _activate(_Player(path, realtime))
@@ -0,0 +1,101 @@
+# This script enumerates the commits shown in reports without walking through every page of huge lists.
+# Only the first and last `limit` commits of a pull request or compare are fetched, each end with an
+# explicit page request; the rest is summarized as a count, so the API cost and the embed size per item
+# stay bounded.
+#
+# Functions:
+# - commit_details: Converts a PyGithub commit to the dictionary used in reports.
+# - trim_commits: Applies the same bound to an already complete commit list.
+# - omitted_commits_position: Returns where the "+K more" line goes in a bounded commit list.
+# - more_commits_line: Formats the "+K more" line linking to the full list.
+# - fetch_commit_range: Fetches a range of a commit list with as few page requests as possible.
+# - compare_commits / pull_request_commits: Return the first and last `limit` commits of a compare or
+#   pull request and how many were left out.
+
+from itertools import islice
+
+from github.Commit import Commit
+
+DEFAULT_COMMIT_LIMIT = 10
+# Compares and pull requests list at most this many commits
+LISTED_COMMITS_CAP = 250
+MAX_PER_PAGE = 100
+
+
+def commit_details(commit):
+    return {"name": commit.commit.message.split('\n')[0], "link": commit.html_url, "sha": commit.sha}
+
+def trim_commits(commits, limit):
+    """Returns (commits, omitted): all commits if there are at most 2 * limit, otherwise the first and last limit."""
+    if not limit or len(commits) <= 2 * limit:
+        return list(commits), 0
+    return commits[:limit] + commits[-limit:], len(commits) - 2 * limit
+
+def omitted_commits_position(item):
+    if not item.get("omitted_commits"):
+        return None
+    return len(item["commits"]) // 2
+
+def more_commits_line(omitted_commits, url, label):
+    return f"… +{omitted_commits} more commits ([{label}]({url}))"
+
+def fetch_commit_range(requester, url, start, count, list_item=None, **params):
+    """
+    Returns `count` commits from index `start` of the commit list at url, oldest first.
+    The page size is picked so that a single page holds all of them whenever possible.
+    """
+    if count <= 0:
+        return []
+    per_page = next((size for size in range(min(count, MAX_PER_PAGE), MAX_PER_PAGE + 1)
+                     if start // size == (start + count - 1) // size), min(count, MAX_PER_PAGE))
+    first_page = start // per_page
+    commits = []
+    for page in range(first_page, (start + count - 1) // per_page + 1):
+        headers, data = requester.requestJsonAndCheck("GET", url, parameters=dict(params, per_page=per_page, page=page + 1))
+        if list_item:
+            data = data[list_item]
+        commits += [Commit(requester, headers, element, completed=False) for element in data]
+    offset = start - first_page * per_page
+    return [commit_details(commit) for commit in commits[offset:offset + count]]
+
+def compare_commits(comparison, limit):
+    """
+    Returns (commits, omitted) for a PyGithub Comparison: the first and last `limit` commits.
+
+    The compare response already holds the first page of up to 250 commits, oldest first,
+    so only a longer compare needs a request, for the page with its last commits.
+    """
+    total = comparison.total_commits
+    preloaded = len(comparison.raw_data.get("commits", []))
+    listed = [commit_details(commit) for commit in islice(comparison.commits, preloaded)]
+    if total <= preloaded:
+        return trim_commits(listed, limit)
+    if not limit:
+        return listed + fetch_commit_range(comparison._requester, comparison.url, preloaded, total - preloaded, list_item="commits"), 0
+
+    head = listed[:limit]
+    tail_count = min(limit, total - limit)
+    tail = fetch_commit_range(comparison._requester, comparison.url, total - tail_count, tail_count, list_item="commits")
+    return head + tail, total - len(head) - len(tail)
+
+def pull_request_commits(repo, pr, limit):
+    """
+    Returns (commits, omitted) for a PyGithub PullRequest of repo: the first and last `limit` commits.
+
+    Both ends are fetched as explicit pages of the pull request's commit list. That list stops after
+    250 commits, so for larger pull requests the last commits are taken from the history of the head commit.
+    """
+    url = f"{pr.url}/commits"
+    total = pr.commits
+    if total <= LISTED_COMMITS_CAP and (not limit or total <= 2 * limit):
+        return fetch_commit_range(pr._requester, url, 0, total), 0
+    limit = limit or LISTED_COMMITS_CAP // 2
+
+    head = fetch_commit_range(pr._requester, url, 0, limit)
+    tail_count = min(limit, total - limit)
+    if total <= LISTED_COMMITS_CAP:
+        tail = fetch_commit_range(pr._requester, url, total - tail_count, tail_count)
+    else:
+        # The history is listed newest first
+        tail = fetch_commit_range(repo._requester, f"{repo.url}/commits", 0, tail_count, sha=pr.head.sha)[::-1]
+    return head + tail, total - len(head) - len(tail)
@@ -0,0 +1,153 @@
+# This script memoizes GitHub compare results between two commits.
+# A compare between two immutable SHAs never changes, so results are stored in a SQLite database
+# keyed by (base SHA, head SHA) and reused across branches, forks and cycles.
+#
+# Functions:
+# - is_sha: Checks whether a ref is already a full commit SHA.
+# - resolve_sha: Resolves a symbolic ref (branch, tag) of a repository to a commit SHA.
+# - CompareCache.compare: Returns the cached comparison of two refs, calling the GitHub API on a miss.
+# - CompareCache.prune: Drops the oldest entries beyond the configured size and empties the in-memory layer;
+#   long-running processes call it once per cycle.
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from observing.utils.commits import compare_commits, trim_commits, DEFAULT_COMMIT_LIMIT
+
+CACHE_DB = 'cache.db'
+DEFAULT_MAX_ENTRIES = 20000
+
+SHA_PATTERN = re.compile(r'[0-9a-f]{40}')
+
+def is_sha(ref):
+    return bool(ref) and SHA_PATTERN.fullmatch(ref) is not None
+
+def resolve_sha(repo, ref):
+    if is_sha(ref):
+        return ref
+    return repo.get_branch(ref).commit.sha
+
+
+class CompareCache:
+    """
+    Cache of compare results keyed by (base SHA, head SHA).
+
+    Entries hold the commit list (name, link, sha) together with the ahead/behind counts. Only the
+    first and last commit_limit commits are kept for long compares; omitted_commits counts the rest.
+    Commit links point to the repository the compare was first made in; GitHub serves them for every
+    repository of the fork network. Without db_dir the cache only lives in memory.
+    """
+
+    def __init__(self, db_dir=None, max_entries=DEFAULT_MAX_ENTRIES, commit_limit=DEFAULT_COMMIT_LIMIT):
+        self.memory = {}
+        self.max_entries = max_entries
+        self.commit_limit = commit_limit
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        if db_dir:
+            self.conn = sqlite3.connect(os.path.join(db_dir, CACHE_DB), timeout=30, check_same_thread=False)
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS compare_cache (
+                    base_sha TEXT,
+                    head_sha TEXT,
+                    payload TEXT,
+                    created_at REAL,
+                    PRIMARY KEY (base_sha, head_sha)
+                )
+            ''')
+            self.conn.commit()
+
+    def _get(self, key):
+        with self.lock:
+            if key in self.memory:
+                return self.memory[key]
+            if self.conn is None:
+                return None
+            row = self.conn.execute('SELECT payload FROM compare_cache WHERE base_sha = ? AND head_sha = ?', key).fetchone()
+            if row is None:
+                return None
+            result = json.loads(row[0])
+            self.memory[key] = result
+            return result
+
+    def _put(self, key, result):
+        with self.lock:
+            self.memory[key] = result
+            if self.conn is not None:
+                self.conn.execute('''
+                    INSERT OR REPLACE INTO compare_cache (base_sha, head_sha, payload, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', key + (json.dumps(result), time.time()))
+                self.conn.commit()
+
+    def compare(self, repo, base, head):
+        """
+        Compares base...head in repo. Symbolic refs are resolved to SHAs first so that a hit is exact;
+        repo may be a callable returning the repository, so it is only fetched when needed.
+        """
+        get_repo = repo if callable(repo) else (lambda: repo)
+        if not is_sha(base):
+            base = resolve_sha(get_repo(), base)
+        if not is_sha(head):
+            head = resolve_sha(get_repo(), head)
+
+        key = (base, head)
+        result = self._bounded(self._get(key))
+        if result is not None:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        comparison = get_repo().compare(base, head)
+        commits, omitted_commits = compare_commits(comparison, self.commit_limit)
+        result = {
+            "base_sha": base,
+            "head_sha": head,
+            "base_commit_sha": comparison.base_commit.sha,
+            "merge_base_sha": comparison.merge_base_commit.sha,
+            "status": comparison.status,
+            "ahead_by": comparison.ahead_by,
+            "behind_by": comparison.behind_by,
+            "total_commits": comparison.total_commits,
+            "html_url": comparison.html_url,
+            "commit_limit": self.commit_limit,
+            "omitted_commits": omitted_commits,
+            "commits": commits,
+        }
+        self._put(key, result)
+        return result
+
+    def _bounded(self, result):
+        # Entries with a complete commit list can be cut to any limit; cut ones only serve the same limit.
+        if result is None or result.get("commit_limit") == self.commit_limit:
+            return result
+        if result.get("omitted_commits"):
+            return None
+        commits, omitted_commits = trim_commits(result["commits"], self.commit_limit)
+        return dict(result, commits=commits, omitted_commits=omitted_commits, commit_limit=self.commit_limit)
+
+    def prune(self):
+        with self.lock:
+            # Entries stay available from the database; only memory-only caches start over.
+            self.memory = {}
+            if self.conn is None or not self.max_entries:
+                return 0
+            deleted = self.conn.execute('''
+                DELETE FROM compare_cache WHERE rowid IN (
+                    SELECT rowid FROM compare_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,)).rowcount
+            self.conn.commit()
+        return deleted
+
+    def close(self):
+        self.prune()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,49 @@
+# This script reads the repository families to observe from the configuration.
+# A configuration either lists several families under FAMILIES, each with its own webhook and
+# database namespace, or describes a single family with the top-level MAIN_REPO/FORKS keys.
+#
+# Functions:
+# - load_families: Returns the families of a configuration with their database directories resolved.
+
+import ast
+import os
+import re
+
+
+def _family_name(main_repo_name):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', main_repo_name)
+
+def load_families(config):
+    """
+    Returns a list of families, each a dict with NAME, MAIN_REPO, FORKS, DISCORD_WEBHOOK_URL and DATABASE_DIR.
+
+    Families listed under FAMILIES get their own subdirectory of DATABASE_DIR (named after NAME, or the
+    main repository) unless they set DATABASE_DIR themselves, and inherit DISCORD_WEBHOOK_URL from the
+    top level. A single-family configuration keeps using DATABASE_DIR directly.
+    """
+    db_root = config.get("DATABASE_DIR")
+    if "FAMILIES" not in config:
+        entries = [dict(config, DATABASE_DIR=db_root)]
+    else:
+        entries = config["FAMILIES"]
+
+    families = []
+    for entry in entries:
+        main_repo_name = entry["MAIN_REPO"]
+        name = entry.get("NAME") or _family_name(main_repo_name)
+        forks = entry.get("FORKS") or []
+        if isinstance(forks, str):
+            forks = ast.literal_eval(forks)
+        families.append({
+            "NAME": name,
+            "MAIN_REPO": main_repo_name,
+            "FORKS": forks,
+            "DISCORD_WEBHOOK_URL": entry.get("DISCORD_WEBHOOK_URL", config.get("DISCORD_WEBHOOK_URL")),
+            "DATABASE_DIR": entry.get("DATABASE_DIR") or os.path.join(db_root, name),
+        })
+
+    names = [family["NAME"] for family in families]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate family names in config: {', '.join(sorted(duplicates))}")
+    return families
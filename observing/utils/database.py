@@ -7,13 +7,12 @@
 # - load_previous_main_repo: Loads the previous state of the main repository from the database.
 # - update_main_repo: Updates the main repository's state in the database with the current state.
 # - fetch_github_branches_and_commits: Retrieves branch names and commit hashes for the main repository and forks.
-# - update_database_with_branches: Updates the database with branch information from GitHub.
 # - initialize_database_with_branches: Initializes the database with branch data, updating existing entries if needed.
 # - init_repo_fam: Initializes the repository family database with branches and commits from GitHub.
 
 import sqlite3
 import json
-from github import Github
+from observing.utils.tokens import github_client_for
 from dotenv import load_dotenv
 import os
 import ast
@@ -22,7 +21,7 @@ load_dotenv()
 
 def fetch_initial_state_main_repo(git_access_token, main_repo_name):
 
-    github_client = Github(git_access_token)
+    github_client = github_client_for(git_access_token)
     main_repo = github_client.get_repo(main_repo_name)
 
     # Fetch branches
@@ -91,7 +90,7 @@ def update_main_repo(db_dir, current_state):
     conn.close()
 
 def fetch_github_branches_and_commits(git_access_token, main_repo_name, forks):
-    github_client = Github(git_access_token)
+    github_client = github_client_for(git_access_token)
     repo_data = {}
     
     # Add main repo and forks to the list
@@ -111,10 +110,6 @@ def fetch_github_branches_and_commits(git_access_token, main_repo_name, forks):
     
     return repo_data
 
-def update_database_with_branches(db_dir, git_access_token, main_repo_name, forks):
-    repo_data = fetch_github_branches_and_commits(git_access_token, main_repo_name, forks)
-    initialize_database_with_branches(db_dir, repo_data)
-
 def initialize_database_with_branches(db_dir, repo_data):
     db_path = os.path.join(db_dir, 'repo_fam.db')
     conn = sqlite3.connect(db_path)
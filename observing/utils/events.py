@@ -0,0 +1,167 @@
+# This script keeps an append-only history of every change the observer detects.
+# Events are stored in an indexed SQLite table next to the state databases, so questions about
+# past activity ("what did fork X push this week?") are answered locally instead of re-crawling GitHub.
+#
+# Functions:
+# - init_events_db: Creates the events table and its indexes if they don't exist.
+# - record_events: Appends a batch of events in a single transaction.
+# - branch_events: Builds events from the branch comparison results of ob_branch.
+# - pr_events: Builds events from the pull request classification of ob_prs.
+# - query_events: Returns events filtered by time window, repository, ref and kind.
+# - summarize_events: Counts events per repository and kind within a time window.
+# - compact_events: Applies the retention policy so the table stays bounded.
+
+import json
+import os
+import sqlite3
+import time
+
+EVENTS_DB = 'events.db'
+
+# Defaults for the retention policy, overridable in config.yaml.
+DEFAULT_RETENTION_DAYS = 180
+DEFAULT_MAX_ROWS = 500000
+
+
+def _connect(db_dir):
+    conn = sqlite3.connect(os.path.join(db_dir, EVENTS_DB))
+    init_events_db(conn)
+    return conn
+
+def init_events_db(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            occurred_at REAL NOT NULL,
+            kind TEXT NOT NULL,
+            repo TEXT NOT NULL,
+            ref TEXT,
+            before_sha TEXT,
+            after_sha TEXT,
+            detail TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_events_time ON events (occurred_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_events_repo_time ON events (repo, occurred_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_events_kind_time ON events (kind, occurred_at)')
+
+def _event(kind, repo, ref=None, before_sha=None, after_sha=None, **detail):
+    return {
+        "kind": kind,
+        "repo": repo,
+        "ref": ref,
+        "before_sha": before_sha,
+        "after_sha": after_sha,
+        "detail": detail,
+    }
+
+def record_events(db_dir, events, occurred_at=None):
+    if not events:
+        return 0
+    occurred_at = occurred_at if occurred_at is not None else time.time()
+    conn = _connect(db_dir)
+    with conn:
+        conn.executemany('''
+            INSERT INTO events (occurred_at, kind, repo, ref, before_sha, after_sha, detail)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(occurred_at, e["kind"], e["repo"], e["ref"], e["before_sha"], e["after_sha"],
+               json.dumps(e["detail"]) if e["detail"] else None) for e in events])
+    conn.close()
+    return len(events)
+
+def branch_events(main_repo_name, new_branches, updated_branches, deleted_branches, rebased_branches, merged_without_pr):
+    events = []
+    for branch in new_branches:
+        events.append(_event("branch_created", f"{branch['repo_owner']}/{branch['repo_name']}", branch["branch_name"],
+                             after_sha=branch["commit_hash"], commits=branch.get("total_commits", len(branch["commits"]))))
+    for branch in updated_branches:
+        events.append(_event("branch_updated", f"{branch['repo_owner']}/{branch['repo_name']}", branch["branch_name"],
+                             branch["previous_commit_hash"], branch["current_commit_hash"], commits=branch.get("total_commits", len(branch["commits"]))))
+    for branch in rebased_branches:
+        events.append(_event("branch_rebased", f"{branch['repo_owner']}/{branch['repo_name']}", branch["branch_name"],
+                             branch["previous_commit_hash"], branch["current_commit_hash"], commits=branch.get("total_commits", len(branch["commits"]))))
+    for branch in deleted_branches:
+        events.append(_event("branch_deleted", f"{branch['repo_owner']}/{branch['repo_name']}", branch["branch_name"],
+                             before_sha=branch["commit_hash"]))
+    for commit in merged_without_pr:
+        events.append(_event("commit_without_pr", main_repo_name, commit.get("branch_name"),
+                             after_sha=commit["sha"], title=commit["name"]))
+    return events
+
+def pr_events(repo_name, merged_prs, unmerged_prs, open_prs, reopened_prs, pr_details):
+    events = []
+    for kind, pr_numbers in (("pr_opened", open_prs), ("pr_reopened", reopened_prs),
+                             ("pr_merged", merged_prs), ("pr_closed", unmerged_prs)):
+        for pr_number in pr_numbers:
+            details = pr_details.get(pr_number) or {}
+            # A merge moves the PR from its head to the merge commit; otherwise the head is the PR's current SHA.
+            if kind == "pr_merged":
+                before_sha, after_sha = details.get("head_sha"), details.get("merge_commit_sha")
+            else:
+                before_sha, after_sha = None, details.get("head_sha")
+            events.append(_event(kind, repo_name, f"pull/{pr_number}", before_sha, after_sha,
+                                 title=details.get("title"), author=details.get("author")))
+    return events
+
+def _filters(since=None, until=None, repo=None, ref=None, kind=None):
+    clauses, params = [], []
+    if since is not None:
+        clauses.append('occurred_at >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('occurred_at < ?')
+        params.append(until)
+    if repo:
+        clauses.append('repo = ?')
+        params.append(repo)
+    if ref:
+        clauses.append('ref = ?')
+        params.append(ref)
+    if kind:
+        clauses.append('kind = ?')
+        params.append(kind)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+def query_events(db_dir, since=None, until=None, repo=None, ref=None, kind=None, limit=None):
+    where, params = _filters(since, until, repo, ref, kind)
+    sql = 'SELECT occurred_at, kind, repo, ref, before_sha, after_sha, detail FROM events' + where + ' ORDER BY occurred_at DESC, id DESC'
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    conn = _connect(db_dir)
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return [
+        {"occurred_at": row[0], "kind": row[1], "repo": row[2], "ref": row[3],
+         "before_sha": row[4], "after_sha": row[5], "detail": json.loads(row[6]) if row[6] else {}}
+        for row in rows
+    ]
+
+def summarize_events(db_dir, since=None, until=None, repo=None, ref=None, kind=None):
+    where, params = _filters(since, until, repo, ref, kind)
+    conn = _connect(db_dir)
+    rows = conn.execute('SELECT repo, kind, COUNT(*) FROM events' + where + ' GROUP BY repo, kind ORDER BY repo, kind', params).fetchall()
+    conn.close()
+    return rows
+
+def compact_events(db_dir, retention_days=DEFAULT_RETENTION_DAYS, max_rows=DEFAULT_MAX_ROWS):
+    conn = _connect(db_dir)
+    deleted = 0
+    with conn:
+        if retention_days:
+            cutoff = time.time() - retention_days * 86400
+            deleted += conn.execute('DELETE FROM events WHERE occurred_at < ?', (cutoff,)).rowcount
+        if max_rows:
+            # Keep only the newest max_rows events.
+            deleted += conn.execute('''
+                DELETE FROM events WHERE id <= (
+                    SELECT id FROM events ORDER BY id DESC LIMIT 1 OFFSET ?
+                )
+            ''', (max_rows,)).rowcount
+    # Only rebuild the file once a sizeable part of it is free pages.
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    total_pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    if total_pages and free_pages * 4 > total_pages:
+        conn.execute('VACUUM')
+    conn.close()
+    return deleted
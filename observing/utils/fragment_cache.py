@@ -0,0 +1,106 @@
+# This script caches the rendered report fragments of pull requests and branches.
+# A fragment only depends on the state and SHAs of its item, so the same pull request or branch showing up
+# again (a reopened PR, a repository retried after a failed cycle, a report posted again after a failed post)
+# is rendered once; the keys include the repository, so branches of different forks never share a fragment. Fragments are kept in memory and stored in the same SQLite database as the compare cache.
+#
+# Functions:
+# - FragmentCache.get / put: Look up and store a fragment by its key.
+# - FragmentCache.render: Returns the cached fragment of a key, rendering and storing it on a miss.
+# - FragmentCache.flush: Writes the fragments rendered since the last flush to the database.
+# - FragmentCache.prune: Drops the oldest entries beyond the configured size and empties the in-memory layer;
+#   long-running processes call it once per cycle.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from observing.utils.compare_cache import CACHE_DB
+
+DEFAULT_MAX_ENTRIES = 20000
+
+
+class FragmentCache:
+    """
+    Cache of rendered report fragments keyed by tuples such as ("pr", url, head SHA, ...).
+
+    New fragments are written to the database in batches by flush() (and close()), since a report can
+    render hundreds of them. Without db_dir the cache only lives in memory.
+    """
+
+    def __init__(self, db_dir=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.memory = {}
+        self.pending = {}
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        if db_dir:
+            self.conn = sqlite3.connect(os.path.join(db_dir, CACHE_DB), timeout=30, check_same_thread=False)
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS fragment_cache (
+                    key TEXT PRIMARY KEY,
+                    fragment TEXT,
+                    created_at REAL
+                )
+            ''')
+            self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            fragment = self.memory.get(key)
+            if fragment is None and self.conn is not None:
+                row = self.conn.execute('SELECT fragment FROM fragment_cache WHERE key = ?', (json.dumps(key),)).fetchone()
+                if row is not None:
+                    fragment = self.memory[key] = row[0]
+            if fragment is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return fragment
+
+    def put(self, key, fragment):
+        with self.lock:
+            self.memory[key] = fragment
+            if self.conn is not None:
+                self.pending[key] = fragment
+        return fragment
+
+    def render(self, key, render, *args):
+        fragment = self.get(key)
+        if fragment is None:
+            fragment = self.put(key, render(*args))
+        return fragment
+
+    def flush(self):
+        with self.lock:
+            if self.conn is None or not self.pending:
+                return
+            now = time.time()
+            self.conn.executemany('INSERT OR REPLACE INTO fragment_cache (key, fragment, created_at) VALUES (?, ?, ?)',
+                                  [(json.dumps(key), fragment, now) for key, fragment in self.pending.items()])
+            self.conn.commit()
+            self.pending = {}
+
+    def prune(self):
+        self.flush()
+        with self.lock:
+            self.memory = {}
+            if self.conn is None or not self.max_entries:
+                return 0
+            deleted = self.conn.execute('''
+                DELETE FROM fragment_cache WHERE rowid IN (
+                    SELECT rowid FROM fragment_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,)).rowcount
+            self.conn.commit()
+        return deleted
+
+    def close(self):
+        self.flush()
+        self.prune()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
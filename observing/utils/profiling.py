@@ -0,0 +1,180 @@
+# This script profiles single observer cycles on demand, without restarting the observer.
+# Profiling is requested with run.py --profile, by creating the flag file `profile_next_cycle` in DATABASE_DIR
+# or by sending SIGUSR1 to main.py or worker.py. While a cycle is profiled, every stage (PR diff, compare_states,
+# find_merged_commits_without_pr, report rendering, DB writes) is recorded with cProfile and tracemalloc, and
+# the results are written to DATABASE_DIR/profiles/cycle-<cycle id>-<stage>.prof / .alloc.txt, plus a summary.
+#
+# On Python 3.12+ a cProfile profiler records the calls of every thread while it is enabled, and allocations
+# can only be attributed to a stage while nothing else runs. A profiled cycle therefore runs in a single thread:
+# run.py then fetches, renders and posts one repository after another, and workers and the coordinator handle
+# their repositories in one thread anyway (only a worker's lease heartbeats may show up in its dumps). Stages
+# also take a lock, so one started from another thread waits instead of mixing into the running stage.
+# A profiled cycle is slower than a normal one; the per-function costs in the dumps are what to compare between
+# cycles. Comparing allocation snapshots takes long on a large heap, so allocations are only sampled on the
+# first runs of a stage.
+#
+# Functions:
+# - stage: Context manager around one stage; does nothing unless a cycle is being profiled.
+# - profiling_cycle: Context manager that profiles the stages run inside it and writes the results.
+# - request_profile / flag_next_cycle / profile_requested: Request profiling in this process or through the flag file.
+# - install_signal_handler: Calls a function on SIGUSR1, e.g. to request profiling of the next cycle.
+
+import contextlib
+import cProfile
+import os
+import signal
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+PROFILE_FLAG = 'profile_next_cycle'
+PROFILES_DIR = 'profiles'
+TOP_ALLOCATIONS = 30
+ALLOCATION_SAMPLES = 5
+
+_OWN_FILES = {tracemalloc.__file__, contextlib.__file__, cProfile.__file__, __file__}
+
+_requested = threading.Event()
+_profiler = None
+
+
+class CycleProfiler:
+    """Collects one cProfile profile and the allocation growth per stage of a cycle."""
+
+    def __init__(self, db_dir, cycle_id, top_allocations=TOP_ALLOCATIONS, allocation_samples=ALLOCATION_SAMPLES):
+        self.directory = os.path.join(db_dir, PROFILES_DIR)
+        self.cycle_id = cycle_id
+        self.top_allocations = top_allocations
+        self.allocation_samples = allocation_samples
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stages = {}
+        self.started_at = None
+        self.own_tracemalloc = False
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.own_tracemalloc = not tracemalloc.is_tracing()
+        if self.own_tracemalloc:
+            tracemalloc.start()
+        self.started_at = time.perf_counter()
+
+
+    @contextmanager
+    def stage(self, name):
+        # A stage started inside another one is accounted to the outer stage.
+        if getattr(self.local, "stage", None):
+            yield
+            return
+
+        with self.lock:
+            self.local.stage = name
+            stats = self.stages.setdefault(name, {"profile": cProfile.Profile(), "calls": 0, "seconds": 0.0, "peak": 0, "allocations": {}})
+            before = tracemalloc.take_snapshot() if stats["calls"] < self.allocation_samples else None
+            tracemalloc.reset_peak()
+            try:
+                stats["profile"].enable()
+                profiling = True
+            except ValueError as e:
+                # Another profiler is active, e.g. when run under python -m cProfile
+                print(f"Profiling of stage {name} skipped: {e}")
+                profiling = False
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                if profiling:
+                    stats["profile"].disable()
+                stats["seconds"] += time.perf_counter() - start
+                stats["calls"] += 1
+                stats["peak"] = max(stats["peak"], tracemalloc.get_traced_memory()[1])
+                if before is not None:
+                    for diff in tracemalloc.take_snapshot().compare_to(before, 'lineno'):
+                        # Snapshots and the profiler itself allocate as well
+                        if diff.traceback[0].filename in _OWN_FILES:
+                            continue
+                        allocation = stats["allocations"].setdefault(diff.traceback, [0, 0])
+                        allocation[0] += diff.size_diff
+                        allocation[1] += diff.count_diff
+                self.local.stage = None
+
+    def finish(self):
+        """Writes the profiles, allocations and a summary of all stages; returns the summary path."""
+        total_seconds = time.perf_counter() - self.started_at
+        if self.own_tracemalloc:
+            tracemalloc.stop()
+
+        summary = [f"Cycle {self.cycle_id}: {total_seconds:.2f} seconds in total", ""]
+        for name, stats in sorted(self.stages.items()):
+            prefix = os.path.join(self.directory, f"cycle-{self.cycle_id}-{name}")
+            stats["profile"].dump_stats(f"{prefix}.prof")
+
+            allocations = sorted(stats["allocations"].items(), key=lambda item: item[1][0], reverse=True)
+            with open(f"{prefix}.alloc.txt", "w") as f:
+                f.write(f"Top {self.top_allocations} allocation sites by memory retained after stage {name} "
+                        f"(first {min(stats['calls'], self.allocation_samples)} of {stats['calls']} runs)\n\n")
+                for traceback, (size, count) in allocations[:self.top_allocations]:
+                    f.write(f"{size / 1024:10.1f} KiB {count:8d} blocks  {traceback[0].filename}:{traceback[0].lineno}\n")
+
+            summary.append(f"{name:32} {stats['calls']:6d} runs {stats['seconds']:10.2f} s  peak {stats['peak'] / 2**20:8.1f} MiB")
+
+        path = os.path.join(self.directory, f"cycle-{self.cycle_id}-summary.txt")
+        with open(path, "w") as f:
+            f.write("\n".join(summary) + "\n")
+        return path
+
+
+@contextmanager
+def stage(name):
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+@contextmanager
+def profiling_cycle(db_dir, cycle_id, enabled=True):
+    """Profiles the stages run inside the block, in any thread, when enabled."""
+    global _profiler
+    if not enabled:
+        yield None
+        return
+
+    profiler = CycleProfiler(db_dir, cycle_id)
+    profiler.start()
+    _profiler = profiler
+    print(f"Profiling cycle {cycle_id}")
+    try:
+        yield profiler
+    finally:
+        _profiler = None
+        print(f"Profile of cycle {cycle_id} written: {profiler.finish()}")
+
+def request_profile():
+    _requested.set()
+
+def flag_next_cycle(db_dir):
+    with open(os.path.join(db_dir, PROFILE_FLAG), "w") as f:
+        f.write(time.strftime('%Y-%m-%d %H:%M:%S') + "\n")
+
+def profile_requested(db_dir=None):
+    """
+    Returns whether the next cycle should be profiled; the request is consumed.
+    The flag file is only checked (and removed) when db_dir is given.
+    """
+    requested = _requested.is_set()
+    _requested.clear()
+    if db_dir:
+        try:
+            os.remove(os.path.join(db_dir, PROFILE_FLAG))
+            requested = True
+        except FileNotFoundError:
+            pass
+    return requested
+
+def install_signal_handler(callback):
+    # SIGUSR1 does not exist on Windows; profiling can still be requested through the flag file there.
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: callback())
@@ -0,0 +1,106 @@
+# This script schedules GitHub work of several repository families on one shared pool of threads.
+# Every family has its own queue of tasks and idle workers pick the families in round-robin order,
+# so a family with many forks can't starve the others. Before running a task the workers wait if
+# the shared GitHub client is about to exhaust its rate limit.
+#
+# Functions:
+# - wait_for_rate_limit: Sleeps until the rate limit resets when fewer than `reserve` requests are left.
+# - FairScheduler.executor: Returns an executor-like handle submitting tasks on behalf of one family.
+# - FairScheduler.shutdown: Stops the worker threads once all queued tasks are done.
+
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+
+DEFAULT_RATE_LIMIT_RESERVE = 100
+
+def wait_for_rate_limit(github_client, reserve=DEFAULT_RATE_LIMIT_RESERVE):
+    remaining, _ = github_client.rate_limiting
+    if remaining >= reserve:
+        return 0
+    delay = max(github_client.rate_limiting_resettime - time.time(), 0) + 1
+    print(f"Only {remaining} GitHub requests left, waiting {delay:.0f} seconds for the rate limit to reset")
+    time.sleep(delay)
+    return delay
+
+
+class _FamilyExecutor:
+    def __init__(self, scheduler, family):
+        self.scheduler = scheduler
+        self.family = family
+
+    def submit(self, fn, *args, **kwargs):
+        return self.scheduler.submit(self.family, fn, *args, **kwargs)
+
+
+class FairScheduler:
+    """
+    Pool of worker threads that serves the task queues of several families in round-robin order.
+    throttle, if given, is called before every task, e.g. to wait for the GitHub rate limit to reset.
+    With workers=0 there are no worker threads and tasks run in the submitting thread, e.g. for a profiled cycle.
+    """
+
+    def __init__(self, workers, throttle=None):
+        self.queues = OrderedDict()
+        self.condition = threading.Condition()
+        self.throttle = throttle
+        self.throttle_lock = threading.Lock()
+        self.stopping = False
+        self.threads = [threading.Thread(target=self._work, name=f"fetcher-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def executor(self, family):
+        return _FamilyExecutor(self, family)
+
+    def submit(self, family, fn, *args, **kwargs):
+        future = Future()
+        if not self.threads:
+            self._run(future, fn, args, kwargs)
+            return future
+        with self.condition:
+            if self.stopping:
+                raise RuntimeError("Scheduler is shut down")
+            self.queues.setdefault(family, deque()).append((future, fn, args, kwargs))
+            self.condition.notify()
+        return future
+
+    def _next_task(self):
+        with self.condition:
+            while True:
+                for family, tasks in self.queues.items():
+                    if tasks:
+                        task = tasks.popleft()
+                        # Move the family to the back so the others are served first next time.
+                        self.queues.move_to_end(family)
+                        return task
+                if self.stopping:
+                    return None
+                self.condition.wait()
+
+    def _work(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            self._run(*task)
+
+    def _run(self, future, fn, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            if self.throttle is not None:
+                # One worker waits for the reset, the others queue up behind it.
+                with self.throttle_lock:
+                    self.throttle()
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def shutdown(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,161 @@
+# This script manages the shared state store used when several observer workers split the polling.
+# Workers register through heartbeats and claim repositories through a lease table; a lease that is
+# not renewed expires and is taken over by the remaining workers. The coordinator opens a cycle, the
+# workers submit one delta per leased repository, and the coordinator merges them into one report.
+#
+# Functions:
+# - connect: Opens the shard database in DATABASE_DIR and creates its tables.
+# - heartbeat: Marks a worker as alive.
+# - sync_repos: Makes the lease table match the configured (family, repository) pairs.
+# - claim_leases: Renews a worker's leases and claims its fair share of free or expired ones.
+# - release_leases: Gives up all leases of a worker, e.g. on shutdown.
+# - holds_lease: Checks that a worker still holds an unexpired lease on a repository.
+# - open_cycle / current_cycle / finish_cycle: Manage the cycles announced by the coordinator.
+# - cycle_profiled: Tells whether the workers should profile their part of a cycle.
+# - pending_repos: Returns the leased repositories that have no delta in a cycle yet.
+# - submit_delta / collect_deltas: Store and read the per-repository deltas of a cycle.
+
+import json
+import math
+import os
+import sqlite3
+import time
+
+SHARDS_DB = 'shards.db'
+DEFAULT_LEASE_TTL = 60
+KEEP_CYCLES = 10
+
+
+def connect(db_dir):
+    conn = sqlite3.connect(os.path.join(db_dir, SHARDS_DB), timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS workers (
+            worker_id TEXT PRIMARY KEY,
+            heartbeat_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            family TEXT,
+            repo TEXT,
+            worker_id TEXT,
+            expires_at REAL,
+            PRIMARY KEY (family, repo)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cycles (
+            cycle_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at REAL,
+            finished_at REAL,
+            profile INTEGER DEFAULT 0
+        )
+    ''')
+    # Shard databases created before cycles could be profiled lack the column
+    if 'profile' not in {row[1] for row in conn.execute('PRAGMA table_info(cycles)')}:
+        conn.execute('ALTER TABLE cycles ADD COLUMN profile INTEGER DEFAULT 0')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS deltas (
+            cycle_id INTEGER,
+            family TEXT,
+            repo TEXT,
+            worker_id TEXT,
+            payload TEXT,
+            created_at REAL,
+            PRIMARY KEY (cycle_id, family, repo)
+        )
+    ''')
+    return conn
+
+def heartbeat(conn, worker_id):
+    conn.execute('''
+        INSERT INTO workers (worker_id, heartbeat_at) VALUES (?, ?)
+        ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at=excluded.heartbeat_at
+    ''', (worker_id, time.time()))
+
+def sync_repos(conn, repos):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        existing = set(conn.execute('SELECT family, repo FROM leases').fetchall())
+        wanted = set(repos)
+        conn.executemany('INSERT INTO leases (family, repo, worker_id, expires_at) VALUES (?, ?, NULL, 0)', sorted(wanted - existing))
+        conn.executemany('DELETE FROM leases WHERE family = ? AND repo = ?', sorted(existing - wanted))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+def claim_leases(conn, worker_id, ttl=DEFAULT_LEASE_TTL):
+    """
+    Renews the leases held by worker_id and claims free or expired ones up to a fair share,
+    i.e. the number of repositories divided by the number of live workers. Leases above the
+    fair share are released, so a worker that joins later gets its part.
+    Returns the (family, repo) pairs leased to the worker.
+    """
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        live_workers = conn.execute('SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?', (now - ttl,)).fetchone()[0]
+        total = conn.execute('SELECT COUNT(*) FROM leases').fetchone()[0]
+        share = math.ceil(total / max(live_workers, 1))
+
+        owned = conn.execute('SELECT family, repo FROM leases WHERE worker_id = ? AND expires_at >= ? ORDER BY family, repo',
+                             (worker_id, now)).fetchall()
+        for family, repo in owned[share:]:
+            conn.execute('UPDATE leases SET worker_id = NULL, expires_at = 0 WHERE family = ? AND repo = ?', (family, repo))
+        owned = owned[:share]
+
+        if len(owned) < share:
+            free = conn.execute('SELECT family, repo FROM leases WHERE worker_id IS NULL OR expires_at < ? ORDER BY family, repo LIMIT ?',
+                                (now, share - len(owned))).fetchall()
+            owned += free
+
+        conn.executemany('UPDATE leases SET worker_id = ?, expires_at = ? WHERE family = ? AND repo = ?',
+                         [(worker_id, now + ttl, family, repo) for family, repo in owned])
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return owned
+
+def release_leases(conn, worker_id):
+    conn.execute('UPDATE leases SET worker_id = NULL, expires_at = 0 WHERE worker_id = ?', (worker_id,))
+    conn.execute('DELETE FROM workers WHERE worker_id = ?', (worker_id,))
+
+def holds_lease(conn, worker_id, family, repo):
+    row = conn.execute('SELECT 1 FROM leases WHERE family = ? AND repo = ? AND worker_id = ? AND expires_at >= ?',
+                       (family, repo, worker_id, time.time())).fetchone()
+    return row is not None
+
+def open_cycle(conn, profile=False):
+    return conn.execute('INSERT INTO cycles (started_at, profile) VALUES (?, ?)', (time.time(), int(profile))).lastrowid
+
+def current_cycle(conn):
+    row = conn.execute('SELECT cycle_id FROM cycles WHERE finished_at IS NULL ORDER BY cycle_id DESC LIMIT 1').fetchone()
+    return row[0] if row else None
+
+def cycle_profiled(conn, cycle_id):
+    row = conn.execute('SELECT profile FROM cycles WHERE cycle_id = ?', (cycle_id,)).fetchone()
+    return bool(row and row[0])
+
+def finish_cycle(conn, cycle_id):
+    conn.execute('UPDATE cycles SET finished_at = ? WHERE cycle_id = ?', (time.time(), cycle_id))
+    # Deltas are only needed until their cycle is merged; keep a few for inspection.
+    conn.execute('DELETE FROM deltas WHERE cycle_id <= ?', (cycle_id - KEEP_CYCLES,))
+    conn.execute('DELETE FROM cycles WHERE cycle_id <= ?', (cycle_id - KEEP_CYCLES,))
+
+def pending_repos(conn, cycle_id, leases):
+    done = set(conn.execute('SELECT family, repo FROM deltas WHERE cycle_id = ?', (cycle_id,)).fetchall())
+    return [lease for lease in leases if lease not in done]
+
+def submit_delta(conn, cycle_id, family, repo, worker_id, delta):
+    # A repository taken over after its worker died may be submitted twice; the first delta wins.
+    conn.execute('''
+        INSERT OR IGNORE INTO deltas (cycle_id, family, repo, worker_id, payload, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (cycle_id, family, repo, worker_id, json.dumps(delta), time.time()))
+
+def collect_deltas(conn, cycle_id):
+    rows = conn.execute('SELECT family, repo, payload FROM deltas WHERE cycle_id = ?', (cycle_id,)).fetchall()
+    return {(family, repo): json.loads(payload) for family, repo, payload in rows}
@@ -0,0 +1,189 @@
+# This script spreads GitHub API requests over a pool of credentials.
+# All requests go through one PyGithub client whose requester picks the credential of every single
+# request when it is sent: the one with the most requests left, as tracked from the rate limit headers
+# of its responses. Repositories, pull requests and paginated lists share that requester, so their lazy
+# loads and further pages are spread over the pool as well. A request refused because its credential
+# ran out of requests is sent again with the next credential that has some left.
+#
+# Functions:
+# - load_credentials: Reads personal access tokens and GitHub App installations from the environment and config.
+# - create_github_client: Returns a PooledGithub client over all configured credentials.
+# - github_client_for: Returns a client for a token string, or the given client unchanged.
+
+import math
+import os
+import threading
+import time
+from io import IOBase
+
+from github import Auth, Consts, Github
+from github.Requester import Requester, WithRequester
+
+
+class _Credential:
+    """One credential of the pool and the rate limit last reported for it."""
+
+    def __init__(self, auth):
+        self.auth = auth
+        self.remaining = -1
+        self.limit = -1
+        self.reset_at = 0
+
+    @property
+    def label(self):
+        if self.auth is None:
+            return "unauthenticated"
+        if isinstance(self.auth, Auth.AppInstallationAuth):
+            return f"app {self.auth.app_id} installation {self.auth.installation_id}"
+        return f"token ...{self.auth.token[-4:]}"
+
+    @property
+    def known(self):
+        return self.limit >= 0
+
+    def headroom(self, now):
+        if not self.known:
+            # Not used yet; try it first to learn its limit
+            return math.inf
+        if self.reset_at <= now:
+            return self.limit
+        return self.remaining
+
+    def update(self, headers):
+        if Consts.headerRateRemaining in headers and Consts.headerRateLimit in headers:
+            self.remaining = int(float(headers[Consts.headerRateRemaining]))
+            self.limit = int(float(headers[Consts.headerRateLimit]))
+        if Consts.headerRateReset in headers:
+            self.reset_at = int(float(headers[Consts.headerRateReset]))
+
+
+class PooledRequester(Requester):
+    """
+    Requester that authenticates every request with the credential that has the most requests left.
+    rate_limiting and rate_limiting_resettime describe the pool as a whole.
+    """
+
+    def __init__(self, credentials, **requester_kwargs):
+        super().__init__(auth=None, **requester_kwargs)
+        # Unauthenticated, like Github(None), when no credential is configured
+        self.credentials = [_Credential(auth) for auth in credentials or [None]]
+        self.pool_lock = threading.Lock()
+        self.next_index = 0
+        for credential in self.credentials:
+            # App installations fetch their tokens through a requester of their own
+            if isinstance(credential.auth, WithRequester):
+                credential.auth.withRequester(self)
+
+    # The base class sets these from every response; for the pool they are derived from the credentials.
+    @property
+    def rate_limiting(self):
+        now = time.time()
+        with self.pool_lock:
+            return (sum(max(credential.headroom(now), 0) for credential in self.credentials if credential.known),
+                    sum(credential.limit for credential in self.credentials if credential.known))
+
+    @rate_limiting.setter
+    def rate_limiting(self, value):
+        pass
+
+    @property
+    def rate_limiting_resettime(self):
+        now = time.time()
+        with self.pool_lock:
+            resets = [credential.reset_at for credential in self.credentials if credential.reset_at > now]
+        return min(resets, default=0)
+
+    @rate_limiting_resettime.setter
+    def rate_limiting_resettime(self, value):
+        pass
+
+    def pick_credential(self, exclude=()):
+        now = time.time()
+        with self.pool_lock:
+            # Start at a rotating index so credentials with equal headroom take turns.
+            count = len(self.credentials)
+            candidates = [self.credentials[(self.next_index + i) % count] for i in range(count)]
+            self.next_index = (self.next_index + 1) % count
+            candidates = [credential for credential in candidates if credential not in exclude] or candidates
+            return max(candidates, key=lambda credential: credential.headroom(now))
+
+    def _Requester__requestRaw(self, cnx, verb, url, requestHeaders, input):
+        tried = []
+        while True:
+            credential = self.pick_credential(tried)
+            tried.append(credential)
+            if credential.auth is not None:
+                requestHeaders["Authorization"] = f"{credential.auth.token_type} {credential.auth.token}"
+            status, responseHeaders, output = super()._Requester__requestRaw(cnx, verb, url, requestHeaders, input)
+            with self.pool_lock:
+                credential.update(responseHeaders)
+            exhausted = status in (403, 429) and credential.remaining == 0
+            # A request body read from a file can't be sent twice
+            if not exhausted or len(tried) == len(self.credentials) or isinstance(input, IOBase):
+                return status, responseHeaders, output
+
+    def credential_stats(self):
+        with self.pool_lock:
+            return [(credential.label, credential.remaining, credential.limit) for credential in self.credentials]
+
+
+def load_credentials(config=None):
+    """
+    Collects the credentials to use: GIT_ACCESS_TOKEN and the comma-separated GIT_ACCESS_TOKENS from
+    the environment, plus the GitHub App installations listed under GITHUB_APPS in the config.
+    """
+    config = config or {}
+    tokens = []
+    for value in [os.getenv('GIT_ACCESS_TOKEN')] + (os.getenv('GIT_ACCESS_TOKENS') or '').split(','):
+        value = (value or '').strip()
+        if value and value not in tokens:
+            tokens.append(value)
+    credentials = [Auth.Token(token) for token in tokens]
+
+    for app in config.get("GITHUB_APPS") or []:
+        with open(app["PRIVATE_KEY_PATH"], "r") as f:
+            private_key = f.read()
+        # Installation tokens are refreshed by PyGithub shortly before they expire
+        credentials.append(Auth.AppInstallationAuth(Auth.AppAuth(app["APP_ID"], private_key), int(app["INSTALLATION_ID"])))
+    return credentials
+
+
+class PooledGithub(Github):
+    """Drop-in replacement for github.Github that sends every request with the credential with the most requests left."""
+
+    def __init__(self, credentials, **github_kwargs):
+        super().__init__(**github_kwargs)
+        requester = self._Github__requester
+        requester_kwargs = requester.kwargs
+        del requester_kwargs["auth"]
+        requester.close()
+        self._Github__requester = PooledRequester(credentials, **requester_kwargs)
+
+    @property
+    def requester(self):
+        return self._Github__requester
+
+    @property
+    def rate_limiting(self):
+        # /rate_limit is free; each call goes to a credential that hasn't been used yet
+        for credential in self.requester.credentials:
+            if not credential.known:
+                self.get_rate_limit()
+        return self.requester.rate_limiting
+
+    @property
+    def rate_limiting_resettime(self):
+        return self.requester.rate_limiting_resettime
+
+    def credential_stats(self):
+        return self.requester.credential_stats()
+
+
+def create_github_client(config=None, **github_kwargs):
+    return PooledGithub(load_credentials(config), **github_kwargs)
+
+def github_client_for(credentials):
+    """Accepts a token string (as passed around by older code) or an already created client."""
+    if credentials is None or isinstance(credentials, str):
+        return PooledGithub([Auth.Token(credentials)] if credentials else [])
+    return credentials
@@ -3,82 +3,129 @@
 # It fetches repository data, compares current and previous states, generates reports on pull requests and branches,
 # and posts these reports to Discord.
 
-from observing.bot.bot import post_to_discord
-from observing.utils.database import load_previous_main_repo, update_main_repo, update_database_with_branches
-from observing.observer.ob_prs import find_open_merged_pr
-from observing.observer.ob_branch import branch_movements
-from github import Github
+from observing.utils.database import load_previous_main_repo
+from observing.utils.events import compact_events, DEFAULT_RETENTION_DAYS, DEFAULT_MAX_ROWS
+from observing.observer.pipeline import run_pipeline, fetch_main_repo_state, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE
+from observing.utils.cassette import recording, replaying
+from observing.utils.commits import DEFAULT_COMMIT_LIMIT
+from observing.utils.compare_cache import CompareCache
+from observing.utils.fragment_cache import FragmentCache
+from observing.utils.profiling import profiling_cycle, profile_requested, stage
+from observing.utils.config import load_families
+from observing.utils.scheduler import FairScheduler, wait_for_rate_limit, DEFAULT_RATE_LIMIT_RESERVE
+from observing.utils.tokens import create_github_client
 from dotenv import load_dotenv
-import os
+import threading
 import time
 import argparse
 import yaml
 
-def run(config):
+def run_family(family, config, github_client, scheduler, compare_cache, fragment_cache, sequential=False):
     """
-    Main function to orchestrate the process of fetching repository data,
-    comparing states, generating reports, and posting them to Discord.
+    Reports the changes of one repository family and updates its database.
+    GitHub requests go through the shared scheduler, so families are served in turn.
     """
+    db_dir = family["DATABASE_DIR"]
+    executor = scheduler.executor(family["NAME"])
 
-    start_time = time.time()
-    print(f"Start time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}")
-
-    load_dotenv()
-    db_dir = config.get("DATABASE_DIR")
-    
     # Load the previous state from the database
     previous_state = load_previous_main_repo(db_dir)
-    
-    # Fetch current fork branches and main repository data
-    access_token = os.getenv('GIT_ACCESS_TOKEN')
-    github_client = Github(access_token)
-    main_repo_name = config["MAIN_REPO"]
-    main_repo = github_client.get_repo(main_repo_name)
-    forks = config.get("FORKS", [])
-    discord_webhook_url = config.get("DISCORD_WEBHOOK_URL")
-
-    # Gather pull requests and branches from the main repository
-    main_prs = {pr.number: pr.state for pr in main_repo.get_pulls(state="all")}
-    main_branches = [branch.name for branch in main_repo.get_branches()]
-
-    # Prepare current state dictionary
-    current_state = {
-        "branches": main_branches,
-        "prs": {int(key): value for key, value in main_prs.items()}
-    }
     previous_state["prs"] = {int(key): value for key, value in previous_state["prs"].items()}
 
-    # Find open and merged pull requests
-    report_prs = find_open_merged_pr(previous_state, current_state, main_repo)
+    # Fetch current main repository data
+    main_repo, current_state = executor.submit(fetch_main_repo_state, github_client, family["MAIN_REPO"]).result()
+
+    # Report pull requests and branch movements, posting each report as soon as it is ready,
+    # and update the database with the current state
+    failed = run_pipeline(db_dir, github_client, main_repo, family["FORKS"], family["DISCORD_WEBHOOK_URL"], previous_state, current_state,
+                          queue_size=config.get("QUEUE_SIZE", DEFAULT_QUEUE_SIZE), executor=executor, compare_cache=compare_cache,
+                          commit_limit=config.get("REPORT_COMMIT_LIMIT", DEFAULT_COMMIT_LIMIT), fragment_cache=fragment_cache,
+                          sequential=sequential)
+    if failed:
+        print(f"[{family['NAME']}] Repositories that will be retried next cycle: {', '.join(failed)}")
+    with stage("db_writes"):
+        compact_events(db_dir, config.get("EVENTS_RETENTION_DAYS", DEFAULT_RETENTION_DAYS), config.get("EVENTS_MAX_ROWS", DEFAULT_MAX_ROWS))
+    print(f"[{family['NAME']}] Reports and database update")
 
-    print("Merged PR report")
-    post_to_discord(report_prs, discord_webhook_url)
+def run(config, profile=False):
+    """
+    Main function to orchestrate the process of fetching repository data,
+    comparing states, generating reports, and posting them to Discord.
+    All families of the configuration share one GitHub client, compare and fragment caches and scheduler.
+    The cycle is profiled when profile is set or the profiling flag file exists in DATABASE_DIR.
+    """
 
-    # Generate branch reports
-    branches_report, merged_branches_without_pr_report = branch_movements(db_dir, access_token, main_repo_name, forks)
-    post_to_discord(branches_report, discord_webhook_url)
-    post_to_discord(merged_branches_without_pr_report, discord_webhook_url)
-    print("Branch report")
+    start_time = time.time()
+    print(f"Start time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}")
 
-    # Update the database with the current state
-    update_main_repo(db_dir, current_state)
-    update_database_with_branches(db_dir, access_token, main_repo_name, forks)
-    print("Database update")
+    load_dotenv()
+    profile = profile_requested(config.get("DATABASE_DIR")) or profile
+    with profiling_cycle(config.get("DATABASE_DIR"), time.strftime('%Y%m%d-%H%M%S', time.localtime(start_time)), enabled=profile):
+        # cProfile records every thread on Python 3.12+, so a profiled cycle runs in this thread only
+        run_families(config, sequential=profile)
 
     end_time = time.time()
     print(f"End time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end_time))}")
     print(f"Time consumed: {end_time - start_time:.2f} seconds")
 
+def run_families(config, sequential=False):
+    """
+    Runs one cycle of every family of the configuration, one thread per family.
+    With sequential, the families and all of their fetches run one after another in the calling thread.
+    """
+    families = load_families(config)
+    workers = 0 if sequential else config.get("FETCH_WORKERS", DEFAULT_WORKERS)
+    rate_limit_reserve = config.get("RATE_LIMIT_RESERVE", DEFAULT_RATE_LIMIT_RESERVE)
+
+    github_client = create_github_client(config, pool_size=max(workers, 1))
+    compare_cache = CompareCache(config.get("DATABASE_DIR"), commit_limit=config.get("REPORT_COMMIT_LIMIT", DEFAULT_COMMIT_LIMIT))
+    fragment_cache = FragmentCache(config.get("DATABASE_DIR"))
+    scheduler = FairScheduler(workers, throttle=lambda: wait_for_rate_limit(github_client, rate_limit_reserve))
+
+    def run_guarded(family):
+        # A failing family must not keep the others from being reported.
+        try:
+            run_family(family, config, github_client, scheduler, compare_cache, fragment_cache, sequential)
+        except Exception as e:
+            print(f"[{family['NAME']}] Cycle failed: {e}")
+
+    if sequential:
+        for family in families:
+            run_guarded(family)
+    else:
+        threads = [threading.Thread(target=run_guarded, args=(family,), name=f"family-{family['NAME']}") for family in families]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    scheduler.shutdown()
+    compare_cache.close()
+    fragment_cache.close()
+    for label, remaining, limit in github_client.credential_stats():
+        print(f"GitHub {label}: {remaining}/{limit} requests left")
+
 if __name__ == "__main__":
     # Parse command-line arguments
     parser = argparse.ArgumentParser(
         description="Monitor a GitHub repository and post updates to Discord."
     )
     parser.add_argument("config_file", help="Path to the YAML configuration file.")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="CASSETTE", help="Record all GitHub and Discord HTTP traffic of this cycle to a cassette file.")
+    cassette.add_argument("--replay", metavar="CASSETTE", help="Replay HTTP traffic from a cassette file instead of using the network.")
+    parser.add_argument("--realtime", action="store_true", help="With --replay, deliver each response at its recorded time offset instead of at full speed.")
+    parser.add_argument("--profile", action="store_true", help="Profile each stage of this cycle and write the results to DATABASE_DIR/profiles.")
     args = parser.parse_args()
 
     # Load configuration from the specified YAML file
     with open(args.config_file, "r") as f:
         config = yaml.safe_load(f)
 
-    run(config)
\ No newline at end of file
+    if args.record:
+        with recording(args.record):
+            run(config, args.profile)
+    elif args.replay:
+        with replaying(args.replay, realtime=args.realtime):
+            run(config, args.profile)
+    else:
+        run(config, args.profile)
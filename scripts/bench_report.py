@@ -0,0 +1,135 @@
+# Micro-benchmark of the report rendering hot path on synthetic reports.
+# Renders branch and pull request reports with thousands of entries without any network access:
+# once without a fragment cache, once filling an empty cache and once with every fragment cached.
+#
+# Usage:
+# - python scripts/bench_report.py --entries 5000 --commits 20 --repeat 5
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from observing.observer.ob_branch import generate_report
+from observing.observer.ob_prs import format_report_prs
+from observing.utils.commits import DEFAULT_COMMIT_LIMIT
+from observing.utils.fragment_cache import FragmentCache
+
+
+class SyntheticRequester:
+    """Serves the commit pages of synthetic pull requests in place of the PyGithub requester."""
+
+    def __init__(self, commits):
+        self.commits = commits
+
+    def requestJsonAndCheck(self, verb, url, parameters=None):
+        per_page, page = parameters["per_page"], parameters["page"]
+        indices = range((page - 1) * per_page, min(page * per_page, self.commits))
+        if "sha" in parameters:
+            # History of the head commit, newest first
+            pr_number = int(parameters["sha"], 16)
+            indices = [self.commits - 1 - i for i in indices]
+        else:
+            # url is .../pulls/<number>/commits
+            pr_number = int(url.split("/")[-2])
+        return {}, [{
+            "sha": f"{pr_number:020x}{i:020x}",
+            "html_url": f"https://github.com/owner/repo/commit/{pr_number:020x}{i:020x}",
+            "commit": {"message": f"Change {i} of pull request {pr_number}\n\nDetails"},
+        } for i in indices]
+
+class SyntheticPull:
+    def __init__(self, number, commits, requester):
+        self.number = number
+        self.title = f"Synthetic pull request {number}"
+        self.url = f"https://api.github.com/repos/owner/repo/pulls/{number}"
+        self.html_url = f"https://github.com/owner/repo/pull/{number}"
+        self.user = type("User", (), {"login": f"author{number % 50}"})()
+        self.head = type("Head", (), {"sha": f"{number:040x}"})()
+        self.merged = number % 2 == 0
+        self.merge_commit_sha = f"{number + 1:040x}"
+        self.commits = commits
+        self._requester = requester
+
+class SyntheticRepo:
+    full_name = "owner/repo"
+    url = "https://api.github.com/repos/owner/repo"
+
+    def __init__(self, commits):
+        self.commits = commits
+        self._requester = SyntheticRequester(commits)
+
+    def get_pull(self, number):
+        return SyntheticPull(number, self.commits, self._requester)
+
+
+def synthetic_branches(entries, commits, commit_limit):
+    branches = []
+    for k in range(entries):
+        commit_list = [{"name": f"Change {i} on branch {k}", "link": f"https://github.com/owner/repo/commit/{k:020x}{i:020x}",
+                        "sha": f"{k:020x}{i:020x}"} for i in range(commits)]
+        omitted_commits = max(len(commit_list) - 2 * commit_limit, 0)
+        if omitted_commits:
+            commit_list = commit_list[:commit_limit] + commit_list[-commit_limit:]
+        branches.append({
+            "repo_owner": f"owner{k % 20}",
+            "repo_name": "repo",
+            "branch_name": f"feature-{k}",
+            "commit_hash": f"{k:040x}",
+            "current_commit_hash": f"{k:040x}",
+            "previous_commit_hash": f"{k + 1:040x}",
+            "commits": commit_list,
+            "total_commits": commits,
+            "omitted_commits": omitted_commits,
+            "compare_url": f"https://github.com/owner{k % 20}/repo/compare/{k + 1:040x}...{k:040x}",
+        })
+    return branches
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rendering of branch and pull request reports.")
+    parser.add_argument("--entries", type=int, default=5000, help="Number of branches and of pull requests per report.")
+    parser.add_argument("--commits", type=int, default=20, help="Number of commits per branch and pull request.")
+    parser.add_argument("--commit-limit", type=int, default=DEFAULT_COMMIT_LIMIT, help="Commits listed from the start and the end of each entry.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case; the fastest one is reported.")
+    args = parser.parse_args()
+
+    branches = synthetic_branches(args.entries, args.commits, args.commit_limit)
+    quarter = len(branches) // 4
+    new, updated, rebased = branches[:quarter], branches[quarter:2 * quarter], branches[3 * quarter:]
+    # Deleted branches are reported from their previous state, without commits
+    deleted = [{key: branch[key] for key in ("repo_owner", "repo_name", "branch_name", "commit_hash")}
+               for branch in branches[2 * quarter:3 * quarter]]
+    repo = SyntheticRepo(args.commits)
+    pr_numbers = list(range(1, args.entries + 1))
+    quarter = len(pr_numbers) // 4
+    merged, unmerged, opened, reopened = pr_numbers[:quarter], pr_numbers[quarter:2 * quarter], pr_numbers[2 * quarter:3 * quarter], pr_numbers[3 * quarter:]
+
+    def branch_report(fragment_cache):
+        return generate_report(new, updated, deleted, rebased, fragment_cache)
+
+    def pr_report(fragment_cache):
+        return format_report_prs(merged, unmerged, opened, reopened, repo, commit_limit=args.commit_limit, fragment_cache=fragment_cache)
+
+    print(f"{args.entries} entries with {args.commits} commits each, best of {args.repeat}")
+    for label, report in (("branch report", branch_report), ("pull request report", pr_report)):
+        uncached = best_of(args.repeat, lambda: report(None))
+        cold = best_of(args.repeat, lambda: report(FragmentCache()))
+        warm_cache = FragmentCache()
+        report(warm_cache)
+        warm = best_of(args.repeat, lambda: report(warm_cache))
+        size = sum(len(field["value"]) for field in report(warm_cache)["fields"])
+        print(f"{label:>20}: uncached {uncached * 1000:8.1f} ms | cold cache {cold * 1000:8.1f} ms | "
+              f"warm cache {warm * 1000:8.1f} ms | {size / 1e6:.1f} MB rendered")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# Multiprocess test of the shard leases against a temporary shards.db.
+# Starts real workers (worker.run_worker) as separate processes with a stubbed repository fetch and
+# checks that a worker joining later gets its fair share of the leases, that the leases of a worker
+# killed in the middle of a cycle are taken over once they expire, and that concurrent submissions of
+# the same repository keep only the first delta.
+#
+# Usage:
+# - python scripts/test_shards.py
+# - python -m pytest scripts/test_shards.py
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from observing.utils import shards
+
+FAMILY = "fam"
+REPOS = ["owner/repo"] + [f"fork{i}/repo" for i in range(5)]
+LEASE_TTL = 2
+POLL_INTERVAL = 0.1
+WAIT_TIMEOUT = 30
+
+
+def _config(db_root):
+    return {
+        "DATABASE_DIR": db_root,
+        "LEASE_TTL": LEASE_TTL,
+        "WORKER_POLL_INTERVAL": POLL_INTERVAL,
+        "FAMILIES": [{"NAME": FAMILY, "MAIN_REPO": REPOS[0], "FORKS": REPOS[1:]}],
+    }
+
+def _hang_flag(db_root, worker_id):
+    return os.path.join(db_root, f"hang-{worker_id}")
+
+def _run_worker(config, worker_id):
+    """Process target: runs a worker whose fetch returns at once, or blocks while its hang flag exists."""
+    import worker
+
+    db_root = config["DATABASE_DIR"]
+
+    def fetch_repo_delta(repo_full_name, previous_state, github_client, compare_cache, main_repo_name=None):
+        while os.path.exists(_hang_flag(db_root, worker_id)):
+            time.sleep(POLL_INTERVAL)
+        return {"repo": repo_full_name, "worker": worker_id}
+
+    sys.stdout = open(os.devnull, "w")
+    worker.create_github_client = lambda config: None
+    worker.load_previous_state = lambda db_path: []
+    worker.fetch_repo_delta = fetch_repo_delta
+    worker.run_worker(config, worker_id)
+
+def _submit(db_root, cycle_id, worker_id, barrier):
+    """Process target: submits a delta for every repository right after the other submitters are ready."""
+    conn = shards.connect(db_root)
+    barrier.wait()
+    for repo in REPOS:
+        shards.submit_delta(conn, cycle_id, FAMILY, repo, worker_id, {"repo": repo, "worker": worker_id})
+    conn.close()
+
+def _lease_holders(conn):
+    holders = {}
+    for worker_id, repo in conn.execute('SELECT worker_id, repo FROM leases WHERE worker_id IS NOT NULL AND expires_at >= ?',
+                                        (time.time(),)):
+        holders.setdefault(worker_id, set()).add(repo)
+    return holders
+
+def _submitters(conn, cycle_id):
+    return dict(conn.execute('SELECT repo, worker_id FROM deltas WHERE cycle_id = ? AND family = ?', (cycle_id, FAMILY)).fetchall())
+
+def _wait_for(condition, description):
+    deadline = time.time() + WAIT_TIMEOUT
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError(f"Timed out waiting for {description}")
+        time.sleep(POLL_INTERVAL)
+
+def _start(context, target, *args):
+    process = context.Process(target=target, args=args, daemon=True)
+    process.start()
+    return process
+
+
+def test_leases_rebalance_and_take_over():
+    db_root = tempfile.mkdtemp()
+    context = multiprocessing.get_context()
+    processes = []
+    try:
+        conn = shards.connect(db_root)
+        shards.sync_repos(conn, {(FAMILY, repo) for repo in REPOS})
+
+        worker_a = _start(context, _run_worker, _config(db_root), "worker-a")
+        processes.append(worker_a)
+        _wait_for(lambda: _lease_holders(conn) == {"worker-a": set(REPOS)}, "worker-a to lease every repository")
+
+        processes.append(_start(context, _run_worker, _config(db_root), "worker-b"))
+        _wait_for(lambda: sorted(len(repos) for repos in _lease_holders(conn).values()) == [3, 3],
+                  "the leases to be split evenly between worker-a and worker-b")
+        holders = _lease_holders(conn)
+        assert not holders["worker-a"] & holders["worker-b"]
+
+        # Every repository is submitted once, by the worker that leases it
+        cycle_id = shards.open_cycle(conn)
+        _wait_for(lambda: len(_submitters(conn, cycle_id)) == len(REPOS), f"every delta of cycle {cycle_id}")
+        submitters = _submitters(conn, cycle_id)
+        for worker_id, repos in holders.items():
+            assert {submitters[repo] for repo in repos} == {worker_id}
+        shards.finish_cycle(conn, cycle_id)
+
+        # worker-a dies in the middle of the next cycle without releasing its leases
+        open(_hang_flag(db_root, "worker-a"), "w").close()
+        cycle_id = shards.open_cycle(conn)
+        _wait_for(lambda: set(_submitters(conn, cycle_id)) == holders["worker-b"], f"worker-b's deltas of cycle {cycle_id}")
+        time.sleep(LEASE_TTL)
+        assert _lease_holders(conn)["worker-a"] == holders["worker-a"], "a hanging fetch must not lose the worker's leases"
+        worker_a.kill()
+        worker_a.join()
+
+        _wait_for(lambda: len(_submitters(conn, cycle_id)) == len(REPOS), f"worker-b to take over the rest of cycle {cycle_id}")
+        assert set(_submitters(conn, cycle_id).values()) == {"worker-b"}
+        assert _lease_holders(conn) == {"worker-b": set(REPOS)}
+        assert {delta["worker"] for delta in shards.collect_deltas(conn, cycle_id).values()} == {"worker-b"}
+        conn.close()
+    finally:
+        for process in processes:
+            process.kill()
+            process.join()
+        shutil.rmtree(db_root, ignore_errors=True)
+
+def test_submit_delta_keeps_first():
+    db_root = tempfile.mkdtemp()
+    context = multiprocessing.get_context()
+    try:
+        conn = shards.connect(db_root)
+        cycle_id = shards.open_cycle(conn)
+        worker_ids = [f"worker-{i}" for i in range(4)]
+        barrier = context.Barrier(len(worker_ids))
+        processes = [_start(context, _submit, db_root, cycle_id, worker_id, barrier) for worker_id in worker_ids]
+        for process in processes:
+            process.join(WAIT_TIMEOUT)
+            assert process.exitcode == 0
+
+        rows = conn.execute('SELECT repo, COUNT(*) FROM deltas WHERE cycle_id = ? GROUP BY repo', (cycle_id,)).fetchall()
+        assert dict(rows) == {repo: 1 for repo in REPOS}
+        submitters = _submitters(conn, cycle_id)
+        deltas = shards.collect_deltas(conn, cycle_id)
+        for repo in REPOS:
+            assert deltas[(FAMILY, repo)] == {"repo": repo, "worker": submitters[repo]}
+
+        # A late submission, e.g. by a worker that was presumed dead, doesn't replace the stored delta
+        shards.submit_delta(conn, cycle_id, FAMILY, REPOS[0], "worker-late", {"repo": REPOS[0], "worker": "worker-late"})
+        assert shards.collect_deltas(conn, cycle_id)[(FAMILY, REPOS[0])]["worker"] == submitters[REPOS[0]]
+        conn.close()
+    finally:
+        shutil.rmtree(db_root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    for test in (test_leases_rebalance_and_take_over, test_submit_delta_keeps_first):
+        start = time.perf_counter()
+        test()
+        print(f"{test.__name__}: ok ({time.perf_counter() - start:.1f}s)")
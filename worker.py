@@ -0,0 +1,249 @@
+# This script splits the polling of the observed repositories across several processes or nodes.
+# All instances share DATABASE_DIR (the state databases and shards.db). Workers claim repositories
+# through a lease table, fetch and diff only their shard and submit one delta per repository; a single
+# coordinator announces the cycles, merges the deltas and posts one Discord report per family and cycle.
+# Creating the profiling flag file in DATABASE_DIR or sending SIGUSR1 to the coordinator profiles the next cycle
+# on all instances; SIGUSR1 to a worker profiles only that worker's part of the next cycle.
+#
+# Usage:
+# - python worker.py config.yaml --coordinator --interval 3600
+# - python worker.py config.yaml --worker-id worker-1   (start as many as needed)
+
+from observing.bot.bot import post_embeds_to_discord, pack_embeds
+from observing.observer.ob_branch import load_previous_state, generate_report, generate_merged_commits_without_pr_report
+from observing.observer.ob_prs import classify_and_format_prs
+from observing.observer.pipeline import fetch_main_repo_state, fetch_repo_delta, group_by_repo, repo_data_from_branches
+from observing.utils.commits import DEFAULT_COMMIT_LIMIT
+from observing.utils.compare_cache import CompareCache
+from observing.utils.fragment_cache import FragmentCache
+from observing.utils.config import load_families
+from observing.utils.database import init_main_repo, init_repo_fam, load_previous_main_repo, update_main_repo, initialize_database_with_branches
+from observing.utils.events import record_events, branch_events, compact_events, DEFAULT_RETENTION_DAYS, DEFAULT_MAX_ROWS
+from observing.utils import shards
+from observing.utils.profiling import profiling_cycle, profile_requested, request_profile, install_signal_handler, stage
+from observing.utils.tokens import create_github_client
+from dotenv import load_dotenv
+import argparse
+import os
+import socket
+import threading
+import time
+import yaml
+
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_CYCLE_TIMEOUT = 1800
+
+def family_repos(family):
+    return [family["MAIN_REPO"]] + [fork for fork in family["FORKS"] if fork != family["MAIN_REPO"]]
+
+def keep_leases(db_root, worker_id, ttl, stop):
+    """
+    Sends heartbeats and renews the worker's leases every third of the lease TTL until stop is set,
+    so fetching a large repository doesn't make the worker look dead. Runs in its own thread and
+    connection, since SQLite connections can't be shared between threads.
+    """
+    conn = shards.connect(db_root)
+    try:
+        while not stop.wait(ttl / 3):
+            try:
+                shards.heartbeat(conn, worker_id)
+                shards.claim_leases(conn, worker_id, ttl)
+            except Exception as e:
+                print(f"[{worker_id}] Failed to renew leases: {e}")
+    finally:
+        conn.close()
+
+def run_worker(config, worker_id):
+    """Claims repositories and submits their deltas for every open cycle until interrupted."""
+    families = {family["NAME"]: family for family in load_families(config)}
+    db_root = config.get("DATABASE_DIR")
+    ttl = config.get("LEASE_TTL", shards.DEFAULT_LEASE_TTL)
+    poll_interval = config.get("WORKER_POLL_INTERVAL", DEFAULT_POLL_INTERVAL)
+
+    github_client = create_github_client(config)
+    os.makedirs(db_root, exist_ok=True)
+    compare_cache = CompareCache(db_root, commit_limit=config.get("REPORT_COMMIT_LIMIT", DEFAULT_COMMIT_LIMIT))
+    conn = shards.connect(db_root)
+    install_signal_handler(request_profile)
+    profiled_cycle = None
+    stop = threading.Event()
+    keeper = threading.Thread(target=keep_leases, args=(db_root, worker_id, ttl, stop), name="lease-keeper", daemon=True)
+    keeper.start()
+    print(f"Worker {worker_id} started")
+
+    try:
+        while True:
+            shards.heartbeat(conn, worker_id)
+            leases = shards.claim_leases(conn, worker_id, ttl)
+            cycle_id = shards.current_cycle(conn)
+            if cycle_id is None:
+                time.sleep(poll_interval)
+                continue
+
+            pending = shards.pending_repos(conn, cycle_id, leases)
+            # Only the first batch of a cycle is profiled, so its files are not overwritten
+            profile = bool(pending) and cycle_id != profiled_cycle and (profile_requested() or shards.cycle_profiled(conn, cycle_id))
+            if profile:
+                profiled_cycle = cycle_id
+            with profiling_cycle(db_root, f"{cycle_id}-{worker_id}", enabled=profile):
+                for family_name, repo_full_name in pending:
+                    family = families.get(family_name)
+                    if family is None:
+                        continue
+                    # The lease may have been handed to another worker since pending was read
+                    if not shards.holds_lease(conn, worker_id, family_name, repo_full_name):
+                        continue
+                    is_main_repo = repo_full_name == family["MAIN_REPO"]
+                    try:
+                        previous_state = group_by_repo(load_previous_state(os.path.join(family["DATABASE_DIR"], 'repo_fam.db'))).get(repo_full_name, [])
+                        delta = fetch_repo_delta(repo_full_name, previous_state, github_client, compare_cache,
+                                                 main_repo_name=family["MAIN_REPO"] if is_main_repo else None)
+                    except Exception as e:
+                        # Submitted as a failure, so the repository isn't fetched again every poll
+                        # and the coordinator doesn't wait for it; it keeps its previous state.
+                        print(f"[{worker_id}] Failed to fetch {repo_full_name}: {e}")
+                        delta = {"failed": True, "error": str(e)}
+                    shards.submit_delta(conn, cycle_id, family_name, repo_full_name, worker_id, delta)
+                    print(f"[{worker_id}] Cycle {cycle_id}: submitted {family_name}/{repo_full_name}")
+            if pending:
+                # The worker never exits, so the cache is trimmed once per cycle instead of on close
+                compare_cache.prune()
+
+            time.sleep(poll_interval)
+    finally:
+        stop.set()
+        keeper.join()
+        shards.release_leases(conn, worker_id)
+        conn.close()
+        compare_cache.close()
+
+def merge_family_deltas(family, deltas):
+    """Merges the per-repository deltas of one family into the lists used by the branch report."""
+    main_delta = deltas.get(family["MAIN_REPO"])
+    merged_without_pr = main_delta["merged_without_pr"] if main_delta else []
+    merged_without_pr_shas = {commit["sha"] for commit in merged_without_pr}
+
+    merged = {"new_branches": [], "updated_branches": [], "deleted_branches": [], "rebased_branches": []}
+    for repo_full_name in family_repos(family):
+        delta = deltas.get(repo_full_name)
+        if delta is None:
+            continue
+        for key in merged:
+            merged[key] += delta[key]
+    merged["merged_without_pr"] = merged_without_pr
+    merged["reported_rebased_branches"] = [
+        branch for branch in merged["rebased_branches"]
+        if any(commit["sha"] not in merged_without_pr_shas for commit in branch["commits"])
+    ]
+    return merged
+
+def report_family(family, deltas, github_client, config, fragment_cache=None):
+    """Posts the merged report of one family and stores its new state."""
+    db_dir = family["DATABASE_DIR"]
+    # A repository that failed to fetch is treated like one without a delta
+    failed = sorted(repo_full_name for repo_full_name, delta in deltas.items() if delta.get("failed"))
+    if failed:
+        print(f"[{family['NAME']}] Repositories that will be retried next cycle: {', '.join(failed)}")
+    deltas = {repo_full_name: delta for repo_full_name, delta in deltas.items() if not delta.get("failed")}
+    previous_state = load_previous_main_repo(db_dir)
+    previous_state["prs"] = {int(key): value for key, value in previous_state["prs"].items()}
+    main_repo, current_state = fetch_main_repo_state(github_client, family["MAIN_REPO"])
+
+    report_prs, events = classify_and_format_prs(previous_state, current_state, main_repo, config.get("REPORT_COMMIT_LIMIT", DEFAULT_COMMIT_LIMIT), fragment_cache)
+    merged = merge_family_deltas(family, deltas)
+    with stage("render"):
+        branches_report = generate_report(merged["new_branches"], merged["updated_branches"], merged["deleted_branches"], merged["reported_rebased_branches"], fragment_cache)
+        merged_commits_without_pr_report = generate_merged_commits_without_pr_report(merged["merged_without_pr"])
+
+    # The state only advances once Discord accepted the report; otherwise the changes are reported next cycle.
+    for embeds in pack_embeds([report_prs, branches_report, merged_commits_without_pr_report]):
+        status_code, text = post_embeds_to_discord(embeds, family["DISCORD_WEBHOOK_URL"])
+        if not 200 <= status_code < 300:
+            raise RuntimeError(f"Discord rejected the report with status {status_code}: {text[:200]}")
+
+    with stage("db_writes"):
+        record_events(db_dir, events + branch_events(family["MAIN_REPO"], merged["new_branches"], merged["updated_branches"],
+                                                     merged["deleted_branches"], merged["rebased_branches"], merged["merged_without_pr"]))
+
+    # Repositories without a delta keep their previous state and are reported next cycle.
+    previous_by_repo = group_by_repo(load_previous_state(os.path.join(db_dir, 'repo_fam.db')))
+    repo_data = {}
+    for repo_full_name in family_repos(family):
+        delta = deltas.get(repo_full_name)
+        branches = delta["current_state"] if delta else previous_by_repo.get(repo_full_name, [])
+        repo_data[repo_full_name] = repo_data_from_branches(repo_full_name, branches)
+    with stage("db_writes"):
+        update_main_repo(db_dir, current_state)
+        initialize_database_with_branches(db_dir, repo_data)
+        compact_events(db_dir, config.get("EVENTS_RETENTION_DAYS", DEFAULT_RETENTION_DAYS), config.get("EVENTS_MAX_ROWS", DEFAULT_MAX_ROWS))
+
+def run_coordinator(config, interval):
+    """Announces a cycle every interval seconds, waits for the workers' deltas and reports them."""
+    families = load_families(config)
+    db_root = config.get("DATABASE_DIR")
+    poll_interval = config.get("WORKER_POLL_INTERVAL", DEFAULT_POLL_INTERVAL)
+    cycle_timeout = config.get("CYCLE_TIMEOUT", DEFAULT_CYCLE_TIMEOUT)
+
+    github_client = create_github_client(config)
+    os.makedirs(db_root, exist_ok=True)
+    conn = shards.connect(db_root)
+    fragment_cache = FragmentCache(db_root)
+    install_signal_handler(request_profile)
+    expected = {(family["NAME"], repo) for family in families for repo in family_repos(family)}
+    shards.sync_repos(conn, expected)
+
+    # Initialize the families' databases, like main.py does for a single process
+    for family in families:
+        os.makedirs(family["DATABASE_DIR"], exist_ok=True)
+        init_main_repo(family["DATABASE_DIR"], github_client, family["MAIN_REPO"])
+        init_repo_fam(family["DATABASE_DIR"], github_client, family["MAIN_REPO"], family["FORKS"])
+
+    while True:
+        # A cycle left open by a previous coordinator is merged as is.
+        cycle_id = shards.current_cycle(conn) or shards.open_cycle(conn, profile=profile_requested(db_root))
+        start_time = time.time()
+        print(f"Cycle {cycle_id} started: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}")
+
+        while True:
+            deltas = shards.collect_deltas(conn, cycle_id)
+            missing = expected - set(deltas)
+            if not missing or time.time() - start_time > cycle_timeout:
+                break
+            time.sleep(poll_interval)
+        if missing:
+            print(f"Cycle {cycle_id}: no delta for {', '.join(f'{f}/{r}' for f, r in sorted(missing))}, retrying next cycle")
+
+        # Close the cycle first, so no worker reads the state while it is being rewritten.
+        shards.finish_cycle(conn, cycle_id)
+        with profiling_cycle(db_root, cycle_id, enabled=shards.cycle_profiled(conn, cycle_id)):
+            for family in families:
+                family_deltas = {repo: delta for (name, repo), delta in deltas.items() if name == family["NAME"]}
+                try:
+                    report_family(family, family_deltas, github_client, config, fragment_cache)
+                except Exception as e:
+                    print(f"[{family['NAME']}] Report failed: {e}")
+        fragment_cache.prune()
+
+        end_time = time.time()
+        print(f"Cycle {cycle_id} finished in {end_time - start_time:.2f} seconds, sleeping for {interval} seconds")
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Run a sharded observer worker or the coordinator.")
+    parser.add_argument("config_file", help="Path to the YAML configuration file.")
+    parser.add_argument("--coordinator", action="store_true", help="Announce cycles and merge the workers' deltas into the reports.")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}", help="Unique name of this worker.")
+    parser.add_argument("--interval", type=int, default=3600, help="Delay between cycles in seconds (coordinator only).")
+    args = parser.parse_args()
+
+    load_dotenv()
+
+    # Load configuration from the specified YAML file
+    with open(args.config_file, "r") as f:
+        config = yaml.safe_load(f)
+
+    if args.coordinator:
+        run_coordinator(config, args.interval)
+    else:
+        run_worker(config, args.worker_id)